@@ -0,0 +1,79 @@
+#  -*- coding: utf-8 -*-
+#
+#              Copyright (C) 2018-2021 ProGeek
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Import time of main.py, the startup cost paid by every --update-now run
+
+Each run imports main in a fresh interpreter with `python -X importtime`. The
+script fails when the median is over the budget, or when one of the slow
+modules, only needed once a request is sent, is imported at startup.
+
+    python -m benchmarks.bench_import [runs] [budget in ms]
+"""
+
+import os
+import sys
+import subprocess
+import statistics
+
+# modules that must be imported only when they are used
+LAZY_MODULES = ('requests', 'urllib3', 'tld', 'asyncio', 'aiohttp', 'schedule')
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def import_times():
+    """Import main in a new interpreter
+
+    :return: list of (cumulative microseconds, depth, module) of the modules imported by main
+    """
+    env = dict(os.environ, CLOUDFLARE_SETTINGS_MODULE='benchmarks.settings')
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import main'], cwd=ROOT, env=env,
+                            capture_output=True, text=True, check=True)
+
+    entries = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        entries.append((int(cumulative), (len(name) - len(name.lstrip()) - 1) // 2, name.strip()))
+
+    # children are printed before their parent, so main's imports are right above it
+    end = next(i for i, (_, depth, name) in enumerate(entries) if depth == 0 and name == 'main')
+    start = end
+    while start > 0 and entries[start - 1][1] > 0:
+        start -= 1
+    return entries[start:end + 1]
+
+
+def main(runs=10, budget=60):
+    runs = [import_times() for _ in range(runs)]
+    total = statistics.median(entries[-1][0] for entries in runs) / 1000
+
+    print('import main: median %.1f ms over %d runs, budget %d ms' % (total, len(runs), budget))
+    print('slowest imports:')
+    for cumulative, depth, name in sorted(runs[-1][:-1], reverse=True)[:10]:
+        print('  %7.1f ms  %s' % (cumulative / 1000, name))
+
+    loaded = sorted({name for _, _, name in runs[-1]} & set(LAZY_MODULES))
+    if loaded:
+        print('imported at startup: %s' % ', '.join(loaded))
+    if loaded or total > budget:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main(*[int(x) for x in sys.argv[1:]])
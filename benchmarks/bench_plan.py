@@ -0,0 +1,114 @@
+#  -*- coding: utf-8 -*-
+#
+#              Copyright (C) 2018-2021 ProGeek
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Compile a records file in a plan, and the cost of each sweep with the plan against grouping CF_SUBDOMAINS
+
+    python -m benchmarks.bench_plan [records]
+"""
+
+import os
+import sys
+import time
+import tempfile
+
+os.environ.setdefault('CLOUDFLARE_SETTINGS_MODULE', 'benchmarks.settings')
+
+import main as cfddns  # noqa: E402
+from cloudflare_ddns.conf import settings  # noqa: E402
+from cloudflare_ddns.Cloudflare import DEFAULT_ACCOUNT, known_zones, pending_records  # noqa: E402
+from cloudflare_ddns.utils.plan import read_records_file, file_records, build_plan  # noqa: E402
+from cloudflare_ddns.utils.records import parse_domain  # noqa: E402
+from cloudflare_ddns.utils.state import AppliedState  # noqa: E402
+from cloudflare_ddns.utils.psl import get_public_suffix_list  # noqa: E402
+
+RECORDS_PER_ZONE = 100
+IP_ADDRESSES = {'A': '192.0.2.1', 'AAAA': '2001:db8::1'}
+
+
+def records_file(directory, count):
+    """A TOML file with `count` A records, RECORDS_PER_ZONE in each zone, written with a range"""
+    path = os.path.join(directory, 'records.toml')
+    with open(path, 'w') as fp:
+        fp.write('[defaults]\nttl = 1\nproxied = false\n')
+        for i in range(0, count, RECORDS_PER_ZONE):
+            size = min(RECORDS_PER_ZONE, count - i)
+            fp.write('\n[[zones]]\nzone = "zone-%d.com"\nrecords = ["host-{1..%d}"]\n' % (i // RECORDS_PER_ZONE, size))
+    return path
+
+
+def subdomains(plan):
+    """The CF_SUBDOMAINS dicts of the same records"""
+    return [{'dns_record': x.name, 'record_type': x.record_type, 'ttl': x.ttl, 'proxied': x.proxied, 'state': True}
+            for x in plan]
+
+
+def dicts_sweep(entries, applied_state):
+    """What a sweep did with the CF_SUBDOMAINS dicts before the plan: filter, group by zone, check the state"""
+    records = [x for x in entries if x.get('state')]
+    zones = {}
+    names = known_zones(DEFAULT_ACCOUNT)
+    for x in records:
+        zones.setdefault((DEFAULT_ACCOUNT, parse_domain(x['dns_record'], names).fld), []).append(x)
+    for zone_records in zones.values():
+        [x for x in zone_records if not applied_state.is_applied(x['record_type'], x['dns_record'],
+                                                                 IP_ADDRESSES.get(x['record_type']))]
+
+
+def plan_sweep(plan, applied_state):
+    """The same work of a sweep with the compiled plan"""
+    for _, records in cfddns.zones_with_ip(plan, IP_ADDRESSES):
+        pending_records(applied_state, records, IP_ADDRESSES)
+
+
+def timed(func, repeat=1):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat
+
+
+def main(count=5000):
+    get_public_suffix_list()
+    applied_state = AppliedState(ttl=3600)
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = records_file(directory, count)
+        read_time = timed(lambda: read_records_file(path))
+        document = read_records_file(path)
+        compile_time = timed(lambda: file_records(document, path))
+
+        settings.CF_SUBDOMAINS = []
+        settings.CF_RECORDS_FILE = path
+        plan = build_plan()
+
+    entries = subdomains(plan)
+    for x in plan:
+        applied_state.remember({'type': x.record_type, 'name': x.name}, IP_ADDRESSES[x.record_type])
+
+    dicts_time = timed(lambda: dicts_sweep(entries, applied_state), 10)
+    plan_time = timed(lambda: plan_sweep(plan, applied_state), 10)
+
+    print('%d DNS records in %d zones' % (len(plan), len(plan.zones)))
+    print('%-32s %8.1f ms' % ('read the TOML file', read_time * 1000))
+    print('%-32s %8.1f ms' % ('expand, check and group', compile_time * 1000))
+    print('%-32s %8.2f ms  %6.2f us/record' % ('sweep with CF_SUBDOMAINS dicts', dicts_time * 1000,
+                                                dicts_time / count * 1e6))
+    print('%-32s %8.2f ms  %6.2f us/record' % ('sweep with the plan', plan_time * 1000, plan_time / count * 1e6))
+
+
+if __name__ == '__main__':
+    main(*[int(x) for x in sys.argv[1:]])
@@ -0,0 +1,85 @@
+#  -*- coding: utf-8 -*-
+#
+#              Copyright (C) 2018-2021 ProGeek
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Split domain names with the compiled public suffix trie against tld.get_tld
+
+    python -m benchmarks.bench_psl [names]
+"""
+
+import os
+import sys
+import time
+import random
+import tempfile
+
+os.environ.setdefault('CLOUDFLARE_SETTINGS_MODULE', 'benchmarks.settings')
+
+from cloudflare_ddns.utils.psl import PublicSuffixList, bundled_psl_file, read_rules  # noqa: E402
+from cloudflare_ddns.utils.records import match_zone  # noqa: E402
+
+
+def synthetic_names(count, seed=42):
+    """Names below random public suffixes, 10 names for each zone"""
+    rnd = random.Random(seed)
+    suffixes = [x.replace('*', 'wild') for x in read_rules(bundled_psl_file()) if not x.startswith('!')]
+    zones = ['zone-%d.%s' % (i, rnd.choice(suffixes)) for i in range(count // 10 + 1)]
+    return ['host-%d.region-%d.%s' % (i, i % 16, zones[i // 10]) for i in range(count)]
+
+
+def timed(func):
+    start = time.perf_counter()
+    result = func()
+    return time.perf_counter() - start, result
+
+
+def main(count=100000):
+    import tld
+
+    names = synthetic_names(count)
+
+    with tempfile.TemporaryDirectory() as directory:
+        cache_path = os.path.join(directory, 'psl.cache')
+        compile_time, psl = timed(lambda: PublicSuffixList.load(cache_path=cache_path))
+        load_time, _ = timed(lambda: PublicSuffixList.load(cache_path=cache_path))
+        cache_size = os.path.getsize(cache_path)
+
+    tld_first, _ = timed(lambda: tld.get_tld(names[0], fix_protocol=True, as_object=True))
+    tld_time, tld_results = timed(lambda: [tld.get_tld(x, fix_protocol=True, as_object=True, fail_silently=True)
+                                           for x in names])
+    psl_time, psl_results = timed(lambda: [psl.split(x) for x in names])
+
+    zones = {x.fld for x in psl_results}
+    zone_time, _ = timed(lambda: [match_zone(x, zones) for x in names])
+
+    # tld only knows the internationalized suffixes in unicode, Cloudflare returns them in punycode
+    mismatches = [x for x, a, b in zip(names, tld_results, psl_results) if a is None or a.fld != b.fld]
+    punycode = sum(1 for x in mismatches if 'xn--' in x)
+
+    print('%d domain names' % count)
+    print('%-28s %8.1f ms' % ('tld first call (load PSL)', tld_first * 1000))
+    print('%-28s %8.1f ms' % ('trie compile + cache write', compile_time * 1000))
+    print('%-28s %8.1f ms  (%d KB)' % ('trie load from cache', load_time * 1000, cache_size // 1024))
+    print('%-28s %8.1f ms  %6.2f us/name' % ('tld.get_tld', tld_time * 1000, tld_time / count * 1e6))
+    print('%-28s %8.1f ms  %6.2f us/name' % ('PublicSuffixList.split', psl_time * 1000, psl_time / count * 1e6))
+    print('%-28s %8.1f ms  %6.2f us/name' % ('match_zone, %d zones' % len(zones), zone_time * 1000,
+                                             zone_time / count * 1e6))
+    print('speedup %.1fx, %d names split differently, %d of them with a punycode suffix' % (
+        tld_time / psl_time, len(mismatches), punycode))
+
+
+if __name__ == '__main__':
+    main(*[int(x) for x in sys.argv[1:]])
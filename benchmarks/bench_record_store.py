@@ -0,0 +1,92 @@
+#  -*- coding: utf-8 -*-
+#
+#              Copyright (C) 2018-2021 ProGeek
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Index a synthetic zone with the RecordStore against the per record tld parsing
+
+    python -m benchmarks.bench_record_store [records] [lookups]
+"""
+
+import os
+import sys
+import time
+
+os.environ.setdefault('CLOUDFLARE_SETTINGS_MODULE', 'benchmarks.settings')
+os.makedirs('log', exist_ok=True)
+
+import tld  # noqa: E402
+
+from cloudflare_ddns.utils.records import RecordStore  # noqa: E402
+
+ZONE_ID = '023e105f4ecef8ad9ca31a8372d0c353'
+
+
+def synthetic_zone(count):
+    types = ('A', 'AAAA', 'CNAME', 'TXT')
+    return [{
+        'id': '%032x' % i,
+        'zone_id': ZONE_ID,
+        'zone_name': 'example.com',
+        'name': 'host-%d.region-%d.example.com' % (i, i % 16),
+        'type': types[i % len(types)],
+        'content': '203.0.113.%d' % (i % 250),
+        'ttl': 1,
+        'proxied': False,
+    } for i in range(count)]
+
+
+def tld_index(result):
+    """How get_dns_records indexed the records before the RecordStore"""
+    dns_records = {'A': {}, 'AAAA': {}}
+    for dns_record in result:
+        name = tld.get_tld(dns_record['name'], fix_protocol=True, as_object=True)
+        if dns_record['type'] in dns_records:
+            dns_records[dns_record['type']][name.subdomain] = dns_record
+    return dns_records
+
+
+def tld_lookup(index, name, record_type):
+    return index[record_type].get(tld.get_tld(name, fix_protocol=True, as_object=True).subdomain)
+
+
+def store_lookup(store, name, record_type):
+    return store.get(ZONE_ID, record_type, name)
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def main(count=10000, lookups=1000):
+    result = synthetic_zone(count)
+    names = [(x['name'], x['type']) for x in result if x['type'] in ('A', 'AAAA')][:lookups]
+
+    index, tld_build = timed(tld_index, result)
+    _, tld_find = timed(lambda: [tld_lookup(index, name, record_type) for name, record_type in names])
+
+    store, store_build = timed(RecordStore, result)
+    _, store_find = timed(lambda: [store_lookup(store, name, record_type) for name, record_type in names])
+
+    print('zone with %d records, %d lookups' % (count, len(names)))
+    print('%-12s build %8.2f ms  lookups %8.2f ms' % ('tld', tld_build * 1000, tld_find * 1000))
+    print('%-12s build %8.2f ms  lookups %8.2f ms' % ('RecordStore', store_build * 1000, store_find * 1000))
+    print('speedup build %.1fx, lookups %.1fx' % (tld_build / store_build, tld_find / store_find))
+
+
+if __name__ == '__main__':
+    main(*[int(x) for x in sys.argv[1:]])
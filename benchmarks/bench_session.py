@@ -0,0 +1,112 @@
+#  -*- coding: utf-8 -*-
+#
+#              Copyright (C) 2018-2021 ProGeek
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Per request latency of a fresh connection against the pooled keep-alive session
+
+A local HTTPS server with a self signed certificate stands in for api.cloudflare.com,
+so the numbers include the TCP and the TLS handshake but not the internet latency.
+
+    python -m benchmarks.bench_session [requests]
+"""
+
+import os
+import sys
+import ssl
+import time
+import tempfile
+import threading
+import subprocess
+import statistics
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+os.environ.setdefault('CLOUDFLARE_SETTINGS_MODULE', 'benchmarks.settings')
+os.makedirs('log', exist_ok=True)
+
+import requests  # noqa: E402
+import urllib3  # noqa: E402
+
+from cloudflare_ddns.utils.http import build_session  # noqa: E402
+
+urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
+
+class TraceHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        body = b'fl=1\nh=1.1.1.1\nip=203.0.113.10\nts=0\n'
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def tls_server(directory):
+    cert = os.path.join(directory, 'cert.pem')
+    key = os.path.join(directory, 'key.pem')
+    subprocess.run(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1', '-subj', '/CN=localhost',
+                    '-keyout', key, '-out', cert], check=True, capture_output=True)
+
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(cert, key)
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), TraceHandler)
+    server.socket = context.wrap_socket(server.socket, server_side=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def measure(get, url, count):
+    timings = []
+    for _ in range(count):
+        start = time.perf_counter()
+        get(url, timeout=10, verify=False).raise_for_status()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def report(name, timings):
+    print('%-22s mean %7.3f ms  median %7.3f ms  p95 %7.3f ms' % (
+        name,
+        statistics.mean(timings) * 1000,
+        statistics.median(timings) * 1000,
+        sorted(timings)[int(len(timings) * 0.95) - 1] * 1000))
+
+
+def main(count=200):
+    with tempfile.TemporaryDirectory() as directory:
+        server = tls_server(directory)
+        url = 'https://127.0.0.1:%d/cdn-cgi/trace' % server.server_address[1]
+
+        fresh = measure(requests.get, url, count)
+        session = build_session(pool_connections=1, pool_maxsize=1, max_retries=0, backoff_factor=0)
+        pooled = measure(session.get, url, count)
+        server.shutdown()
+
+    print('%d HTTPS requests to a local TLS server' % count)
+    report('requests.get', fresh)
+    report('pooled session', pooled)
+    print('speedup %.1fx' % (statistics.mean(fresh) / statistics.mean(pooled)))
+
+
+if __name__ == '__main__':
+    main(*[int(x) for x in sys.argv[1:]])
@@ -0,0 +1,129 @@
+#  -*- coding: utf-8 -*-
+#
+#              Copyright (C) 2018-2021 ProGeek
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Wall time, API requests and client CPU per record of the updates, against the local API stand-in
+
+Every configuration runs three scenarios, all the records start with a stale IP:
+  update_record     Cloudflare.update_record() for each record, like SCHEDULE_MODE = 'record'
+  sweep             main.cloudflare_sweep(), like SCHEDULE_MODE = 'sweep'
+  sweep unchanged   a second sweep right after, when nothing changed
+
+The CPU used by the API stand-in, which runs in the same process, is not counted.
+
+    python -m benchmarks.bench_sweep [records ...] [--latency 0.005] [--throttle 0.01]
+"""
+
+import os
+import time
+import logging
+import argparse
+
+os.environ.setdefault('CLOUDFLARE_SETTINGS_MODULE', 'benchmarks.settings')
+
+import main as cfddns  # noqa: E402
+from cloudflare_ddns.conf import settings  # noqa: E402
+from cloudflare_ddns.Cloudflare import Cloudflare  # noqa: E402
+from cloudflare_ddns.utils.ips import clear_ip_cache  # noqa: E402
+from cloudflare_ddns.utils.http import get_session  # noqa: E402
+from cloudflare_ddns.utils.psl import get_public_suffix_list  # noqa: E402
+from cloudflare_ddns.utils.plan import reload_plan  # noqa: E402
+from benchmarks.mock_api import MockCloudflareAPI  # noqa: E402
+
+STALE_IP = '192.0.2.1'
+RECORDS_PER_ZONE = 100
+
+
+def populate(api, count):
+    """Add `count` A records with a stale IP, RECORDS_PER_ZONE in each zone
+
+    :return: the CF_SUBDOMAINS entries of the records
+    """
+    subdomains = []
+    for i in range(count):
+        zone = 'zone-%d.com' % (i // RECORDS_PER_ZONE)
+        name = 'host-%d.%s' % (i, zone)
+        api.add_record(name, 'A', STALE_IP, zone=zone)
+        subdomains.append({'dns_record': name, 'record_type': 'A', 'ttl': 1, 'proxied': False, 'state': True})
+    return subdomains
+
+
+def reset(api, stale=True):
+    """Forget what the client knows, and make the records stale again"""
+    if stale:
+        for record in api.records.values():
+            record['content'] = STALE_IP
+        Cloudflare.applied_state.clear()
+    Cloudflare.zone_cache.clear()
+    clear_ip_cache()
+    api.reset_counters()
+
+
+def update_each_record():
+    cf = Cloudflare()
+    for x in settings.CF_SUBDOMAINS:
+        cf.update_record(subdomain=x['dns_record'], record_type=x['record_type'], ttl=x['ttl'], proxied=x['proxied'])
+
+
+def measure(api, count, name, func):
+    start_cpu = time.process_time()
+    start = time.perf_counter()
+    func()
+    wall = time.perf_counter() - start
+    cpu = time.process_time() - start_cpu - api.server_cpu
+
+    requests = sum(api.requests.values())
+    throttled = sum(v for (_, route), v in api.requests.items() if route == '429')
+    print('%8d  %-16s %9.3f %9d %9.2f %9d %12.3f' % (
+        count, name, wall, requests, requests / count, throttled, cpu / count * 1000))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('records', type=int, nargs='*', default=[1, 100, 10000])
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every API response')
+    parser.add_argument('--throttle', type=float, default=0.0, help='share of API requests answered with 429')
+    arguments = parser.parse_args()
+
+    # the 429 are retried right away, only the ones injected by --throttle are measured
+    settings.CF_RATE_LIMIT = 0
+    logging.getLogger('cf_logging').setLevel(logging.ERROR)
+
+    # one time costs of the first run, not of the records
+    get_session()
+    get_public_suffix_list()
+
+    print('%8s  %-16s %9s %9s %9s %9s %12s' % (
+        'records', 'scenario', 'wall s', 'requests', 'req/rec', '429', 'CPU ms/rec'))
+    for count in arguments.records:
+        api = MockCloudflareAPI(latency=arguments.latency, throttle=arguments.throttle).start()
+        api.configure(settings)
+        settings.CF_SUBDOMAINS = populate(api, count)
+        reload_plan()
+
+        reset(api)
+        measure(api, count, 'update_record', update_each_record)
+        reset(api)
+        measure(api, count, 'sweep', cfddns.cloudflare_sweep)
+        reset(api, stale=False)
+        measure(api, count, 'sweep unchanged', cfddns.cloudflare_sweep)
+
+        api.stop()
+    cfddns.shutdown_executors()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+#  -*- coding: utf-8 -*-
+#
+#              Copyright (C) 2018-2021 ProGeek
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Check against the local API stand-in that the changed DNS records of a zone are updated with one request
+
+For every zone with N changed records a sweep must send a single batch request, and a zone with one
+changed record a single PATCH. The settings have no CLOUDFLARE_ZONE_DNS_RECORDS_BATCH_API, like a
+settings.py copied before the batch updates, so the URL derived from the DNS records one is checked too.
+
+    python -m benchmarks.check_batch [records per zone]
+"""
+
+import os
+import sys
+import logging
+
+os.environ.setdefault('CLOUDFLARE_SETTINGS_MODULE', 'benchmarks.settings')
+
+from cloudflare_ddns.conf import settings  # noqa: E402
+from cloudflare_ddns.utils.plan import reload_plan  # noqa: E402
+from benchmarks.mock_api import MockCloudflareAPI, reset_client, engines, sweep, check_requests, report  # noqa: E402
+
+STALE_IP = '192.0.2.1'
+ZONES = 3
+
+
+def populate(api, per_zone):
+    """ZONES zones with `per_zone` stale A records each, plus a zone with a single stale record
+
+    :return: the CF_SUBDOMAINS entries of the records
+    """
+    names = ['host-%d.zone-%d.com' % (i, z) for z in range(ZONES) for i in range(per_zone)] + ['www.single.com']
+    for name in names:
+        api.add_record(name, 'A', STALE_IP)
+    return [{'dns_record': x, 'record_type': 'A', 'ttl': 1, 'proxied': False, 'state': True} for x in names]
+
+
+def main(per_zone=5):
+    logging.getLogger('cf_logging').setLevel(logging.ERROR)
+
+    api = MockCloudflareAPI().start()
+    api.configure(settings)
+    del settings.CLOUDFLARE_ZONE_DNS_RECORDS_BATCH_API
+    settings.CF_SUBDOMAINS = populate(api, per_zone)
+    reload_plan()
+
+    # the zones are listed once, then each zone is listed and updated with a single request
+    expected = {('GET', 'zones'): 1, ('GET', 'dns_records'): ZONES + 1, ('POST', 'batch'): ZONES,
+                ('PATCH', 'dns_record'): 1}
+    errors = []
+    for engine in engines():
+        for record in api.records.values():
+            record['content'] = STALE_IP
+        reset_client(api)
+        sweep(engine)
+        errors.extend(check_requests(api, engine, expected))
+        stale = [x['name'] for x in api.records.values() if x['content'] == STALE_IP]
+        if stale:
+            errors.append('%s: %d DNS records not updated' % (engine, len(stale)))
+
+    api.stop()
+    return report(errors)
+
+
+if __name__ == '__main__':
+    sys.exit(main(*[int(x) for x in sys.argv[1:]]))
@@ -0,0 +1,112 @@
+#  -*- coding: utf-8 -*-
+#
+#              Copyright (C) 2018-2021 ProGeek
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Check that the failed external IP services are replaced while a slow one is still running
+
+The services are, from the best ranked: one answering after 5 seconds, one failing, one answering
+a private IP and two answering the public IP. With a quorum of 1 and a timeout of 3 seconds, both
+engines must find the public IP from the fourth service, soon after the hedge delay.
+
+    python -m benchmarks.check_hedge
+"""
+
+import os
+import sys
+import time
+import asyncio
+import logging
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+os.environ.setdefault('CLOUDFLARE_SETTINGS_MODULE', 'benchmarks.settings')
+
+from cloudflare_ddns.conf import settings  # noqa: E402
+from cloudflare_ddns.utils.ips import get_ipv4_address  # noqa: E402
+from benchmarks.mock_api import reset_client, engines, report  # noqa: E402
+
+PUBLIC_IP = '93.184.216.34'
+ANSWERS = {'/slow': (5.0, 200, PUBLIC_IP), '/bad': (0, 500, ''), '/private': (0, 200, '192.168.1.10'),
+           '/good': (0, 200, PUBLIC_IP), '/good2': (0, 200, PUBLIC_IP)}
+
+
+class Handler(BaseHTTPRequestHandler):
+    queried = []
+
+    def do_GET(self):
+        self.queried.append(self.path)
+        delay, status, body = ANSWERS[self.path]
+        time.sleep(delay)
+        try:
+            self.send_response(status)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body.encode())
+        except OSError:
+            pass
+
+    def log_message(self, format, *args):
+        pass
+
+
+def check(engine, resolve):
+    """
+    :return: list of the failed checks
+    """
+    reset_client()
+    Handler.queried.clear()
+    start = time.monotonic()
+    ip_address = resolve()
+    duration = time.monotonic() - start
+    print('%-8s %s in %.2f seconds, queried %s' % (engine, ip_address, duration, ', '.join(Handler.queried)))
+
+    errors = []
+    if ip_address != PUBLIC_IP:
+        errors.append('%s: got %s, expected %s' % (engine, ip_address, PUBLIC_IP))
+    if duration > settings.EXTERNAL_IP_HEDGE_DELAY + 1:
+        errors.append('%s: took %.2f seconds' % (engine, duration))
+    return errors
+
+
+def main():
+    logging.getLogger('cf_logging').setLevel(logging.CRITICAL)
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = 'http://127.0.0.1:%d' % server.server_port
+    settings.EXTERNAL_IPV4_QUERY_APIS = [base + x for x in ANSWERS]
+    settings.EXTERNAL_IPV4_QUORUM = 1
+    settings.EXTERNAL_IP_HEDGE_DELAY = 1.0
+
+    async def resolve_async():
+        from cloudflare_ddns.AsyncCloudflare import AsyncCloudflare
+
+        async with AsyncCloudflare() as cf:
+            return await cf.get_ipv4_address(quorum=1, timeout=3)
+
+    resolvers = {'schedule': lambda: get_ipv4_address(quorum=1, timeout=3),
+                 'asyncio': lambda: asyncio.run(resolve_async())}
+    errors = []
+    for engine in engines():
+        errors.extend(check(engine, resolvers[engine]))
+
+    server.shutdown()
+    return report(errors)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
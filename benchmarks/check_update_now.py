@@ -0,0 +1,91 @@
+#  -*- coding: utf-8 -*-
+#
+#              Copyright (C) 2018-2021 ProGeek
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Check against the local API stand-in that an --update-now run with nothing to change doesn't call Cloudflare
+
+main.py --update-now runs twice in new processes, like a cron job, with CF_ZONE_CACHE_FILE and CF_STATE_FILE
+set. The first run lists the zones and updates the records. The second one finds everything in the files and
+must not send any request to the Cloudflare API, only to the external IP service.
+
+    python -m benchmarks.check_update_now
+"""
+
+import os
+import sys
+import tempfile
+import subprocess
+
+from benchmarks.mock_api import MockCloudflareAPI, engines, report
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STALE_IP = '192.0.2.1'
+NAMES = {'www.example.com': 'example.com', 'www.sub.example.com': 'sub.example.com'}
+
+
+def update_now(directory):
+    """Run main.py --update-now with the settings written in the directory
+
+    :return: the exit status
+    """
+    env = dict(os.environ, CLOUDFLARE_SETTINGS_MODULE='update_now_settings',
+               PYTHONPATH=os.pathsep.join([directory, ROOT]))
+    result = subprocess.run([sys.executable, os.path.join(ROOT, 'main.py'), '--update-now'], cwd=ROOT, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True)
+    if result.returncode:
+        print(result.stderr[-2000:])
+    return result.returncode
+
+
+def main():
+    api = MockCloudflareAPI().start()
+    for name, zone in NAMES.items():
+        api.add_record(name, 'A', STALE_IP, zone=zone)
+
+    errors = []
+    for engine in engines():
+        for record in api.records.values():
+            record['content'] = STALE_IP
+
+        with tempfile.TemporaryDirectory() as directory:
+            api.write_settings(
+                os.path.join(directory, 'update_now_settings.py'),
+                CF_SUBDOMAINS=[{'dns_record': x, 'state': True} for x in NAMES],
+                CF_ZONE_CACHE_FILE=os.path.join(directory, 'zones.json'),
+                CF_STATE_FILE=os.path.join(directory, 'state.json'),
+                SCHEDULE_ENGINE=engine,
+            )
+            for run in ('first', 'second'):
+                api.reset_counters()
+                status = update_now(directory)
+                requests = api.api_requests()
+                print('%-8s %-6s run: exit status %d, %s' % (engine, run, status, requests))
+                if status:
+                    errors.append('%s: the %s run exited with %d' % (engine, run, status))
+
+        if requests:
+            errors.append('%s: the second run sent %d requests to the Cloudflare API' % (
+                engine, sum(requests.values())))
+        stale = [x['name'] for x in api.records.values() if x['content'] == STALE_IP]
+        if stale:
+            errors.append('%s: DNS records not updated: %s' % (engine, ', '.join(stale)))
+
+    api.stop()
+    return report(errors)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
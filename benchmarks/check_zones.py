@@ -0,0 +1,106 @@
+#  -*- coding: utf-8 -*-
+#
+#              Copyright (C) 2018-2021 ProGeek
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Check against the local API stand-in that the records of a zone delegated below a registered domain are updated
+
+The account has the zones example.com and sub.example.com, the public suffix list only knows example.com.
+The first sweep must list the zones once and group the records of sub.example.com in their own zone, the
+next sweeps and the single record updates must not list them again.
+
+    python -m benchmarks.check_zones
+"""
+
+import os
+import sys
+import logging
+
+os.environ.setdefault('CLOUDFLARE_SETTINGS_MODULE', 'benchmarks.settings')
+
+import main as cfddns  # noqa: E402
+from cloudflare_ddns.conf import settings  # noqa: E402
+from cloudflare_ddns.Cloudflare import Cloudflare  # noqa: E402
+from cloudflare_ddns.utils.plan import get_plan, reload_plan  # noqa: E402
+from benchmarks.mock_api import MockCloudflareAPI, reset_client, engines, sweep, check_requests, report  # noqa: E402
+
+STALE_IP = '192.0.2.1'
+NAMES = {'www.example.com': 'example.com', 'www.sub.example.com': 'sub.example.com',
+         'api.sub.example.com': 'sub.example.com'}
+
+
+class ErrorCounter(logging.Handler):
+    def __init__(self):
+        super().__init__(logging.ERROR)
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+def check(engine, logged):
+    """
+    :return: list of the failed checks
+    """
+    errors = ['%s: %s' % (engine, x) for x in logged.messages]
+    logged.messages.clear()
+    zones = sorted(zone for _, zone in get_plan().zones)
+    if zones != ['example.com', 'sub.example.com']:
+        errors.append('%s: the plan zones are %s' % (engine, zones))
+    return errors
+
+
+def main():
+    logged = ErrorCounter()
+    logging.getLogger('cf_logging').addHandler(logged)
+    logging.getLogger('cf_logging').setLevel(logging.ERROR)
+
+    api = MockCloudflareAPI().start()
+    api.configure(settings)
+    for name, zone in NAMES.items():
+        api.add_record(name, 'A', STALE_IP, zone=zone)
+    settings.CF_SUBDOMAINS = [{'dns_record': x, 'record_type': 'A', 'ttl': 1, 'proxied': False, 'state': True}
+                              for x in NAMES]
+
+    # the zones are listed once, then each of the two zones is listed and updated
+    expected = {('GET', 'zones'): 1, ('GET', 'dns_records'): 2, ('PATCH', 'dns_record'): 1, ('POST', 'batch'): 1}
+    errors = []
+    for engine in engines():
+        for record in api.records.values():
+            record['content'] = STALE_IP
+        reset_client(api)
+        reload_plan()
+        sweep(engine)
+        sweep(engine)
+        errors.extend(check_requests(api, engine, expected))
+        stale = [x['name'] for x in api.records.values() if x['content'] == STALE_IP]
+        if stale:
+            errors.append('%s: DNS records not updated: %s' % (engine, ', '.join(stale)))
+        errors.extend(check(engine, logged))
+
+    # the single record updates find the delegated zone without listing the zones again
+    api.reset_counters()
+    for record in get_plan():
+        Cloudflare.applied_state.forget(record.record_type, record.name)
+        cfddns.cloudflare_job(record)
+    errors.extend(check_requests(api, 'records', {('GET', 'zones'): 0, ('GET', 'dns_records'): 3}))
+    errors.extend(check('records', logged))
+
+    api.stop()
+    return report(errors)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
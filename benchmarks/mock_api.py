@@ -0,0 +1,320 @@
+#  -*- coding: utf-8 -*-
+#
+#              Copyright (C) 2018-2021 ProGeek
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""In-process stand-in of the Cloudflare v4 API and of the /cdn-cgi/trace endpoint
+
+It serves the requests made by the client: the zones, the dns_records list with the
+type, name and pagination filters, the update of a record and the batch endpoint.
+The latency of every response and a share of 429 Too Many Requests can be injected.
+
+    api = MockCloudflareAPI(latency=0.005, throttle=0.01)
+    api.start()
+    api.add_record('www.example.com', 'A', '192.0.2.1')
+    api.configure(settings)
+
+The check scripts run the same scenario with each engine, see reset_client, engines, sweep
+and check_requests.
+"""
+
+import re
+import json
+import time
+import random
+import asyncio
+import threading
+from collections import Counter
+from urllib.parse import urlsplit, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ZONE_RE = re.compile(r'^/client/v4/zones/([^/]+)/dns_records(?:/([^/]+))?$')
+
+
+class MockCloudflareAPI(object):
+
+    def __init__(self, ip_address='93.184.216.34', latency=0.0, throttle=0.0, seed=42):
+        """
+        :param ip_address: the external IP returned by /cdn-cgi/trace
+        :param latency: seconds added to every response
+        :param throttle: share of the API requests answered with 429 Too Many Requests
+        :param seed: the 429 are random, but the same on every run
+        """
+        self.ip_address = ip_address
+        self.latency = latency
+        self.throttle = throttle
+        self.zones = {}
+        self.records = {}
+        self.requests = Counter()
+        self.server_cpu = 0.0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = None
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%d' % self._server.server_address[1]
+
+    def start(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True
+
+            def handle_one_request(self):
+                start = time.thread_time()
+                super().handle_one_request()
+                with api._lock:
+                    api.server_cpu += time.thread_time() - start
+
+            def do_GET(self):
+                api.dispatch(self, 'GET')
+
+            def do_PUT(self):
+                api.dispatch(self, 'PUT')
+
+            def do_PATCH(self):
+                api.dispatch(self, 'PATCH')
+
+            def do_POST(self):
+                api.dispatch(self, 'POST')
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def configure(self, settings):
+        """Point the client settings to this API
+
+        :param settings: cloudflare_ddns.conf.settings
+        :return:
+        """
+        for name, value in self.settings().items():
+            setattr(settings, name, value)
+
+    def settings(self):
+        """The settings that point the client to this API
+
+        :return: dict with the setting name as key
+        """
+        base = self.url + '/client/v4'
+        return {
+            'CLOUDFLARE_ENDPOINT_API': base,
+            'CLOUDFLARE_USER_API': base + '/user',
+            'CLOUDFLARE_ZONE_API': base + '/zones',
+            'CLOUDFLARE_ZONE_DNS_RECORDS_QUERY_API': base + '/zones/{zone_id}/dns_records',
+            'CLOUDFLARE_ZONE_DNS_RECORDS_UPDATE_API': base + '/zones/{zone_id}/dns_records/{dns_record_id}',
+            'CLOUDFLARE_ZONE_DNS_RECORDS_BATCH_API': base + '/zones/{zone_id}/dns_records/batch',
+            'EXTERNAL_CF_IPV4_QUERY_API': self.url + '/cdn-cgi/trace',
+            'EXTERNAL_CF_IPV6_QUERY_API': self.url + '/cdn-cgi/trace',
+            'QUERY_CF_FOR_EXTERNAL_IP': True,
+        }
+
+    def write_settings(self, path, **options):
+        """Write a settings module that points the client to this API, for a script run in another process
+
+        :param path: the .py file, its directory must be in the PYTHONPATH of the process
+        :param options: other settings
+        :return:
+        """
+        lines = ['from benchmarks.settings import *  # noqa', '']
+        lines.extend('%s = %r' % item for item in dict(self.settings(), **options).items())
+        with open(path, 'w') as fp:
+            fp.write('\n'.join(lines) + '\n')
+
+    def api_requests(self):
+        """The requests counted since the last reset, without the ones to the /cdn-cgi/trace IP service
+
+        :return: dict with (method, route) as key
+        """
+        with self._lock:
+            return {key: count for key, count in self.requests.items() if key[1] != 'trace'}
+
+    def add_zone(self, name):
+        zone_id = '%032x' % (len(self.zones) + 1)
+        self.zones[name] = zone_id
+        return zone_id
+
+    def add_record(self, name, record_type, content, zone=None, ttl=1, proxied=False):
+        zone = zone or '.'.join(name.split('.')[-2:])
+        zone_id = self.zones.get(zone) or self.add_zone(zone)
+        record_id = '%032x' % (len(self.records) + 1)
+        self.records[record_id] = {
+            'id': record_id, 'zone_id': zone_id, 'zone_name': zone, 'name': name, 'type': record_type,
+            'content': content, 'ttl': ttl, 'proxied': proxied, 'modified_on': '2021-01-01T00:00:00Z',
+        }
+        return record_id
+
+    def reset_counters(self):
+        with self._lock:
+            self.requests.clear()
+            self.server_cpu = 0.0
+
+    def dispatch(self, handler, method):
+        url = urlsplit(handler.path)
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+        length = int(handler.headers.get('Content-Length') or 0)
+        body = json.loads(handler.rfile.read(length)) if length else None
+
+        if self.latency:
+            time.sleep(self.latency)
+
+        if url.path == '/cdn-cgi/trace':
+            self.count(method, 'trace')
+            return self.send(handler, 200, 'fl=1\nip=%s\nts=0\n' % self.ip_address, content_type='text/plain')
+
+        if self.throttle and self._random.random() < self.throttle:
+            self.count(method, '429')
+            return self.send(handler, 429, {'success': False, 'errors': [{'code': 10000, 'message': 'Rate limited'}]},
+                             headers={'Retry-After': '0'})
+
+        if url.path == '/client/v4/zones':
+            self.count(method, 'zones')
+            zones = [{'id': v, 'name': k} for k, v in self.zones.items() if query.get('name', k) == k]
+            return self.send(handler, 200, self.page(zones, query))
+
+        match = ZONE_RE.match(url.path)
+        if not match:
+            return self.send(handler, 404, {'success': False, 'errors': [{'message': 'Not found'}]})
+
+        zone_id, record_id = match.groups()
+        if record_id is None and method == 'GET':
+            self.count(method, 'dns_records')
+            records = [x for x in self.records.values() if x['zone_id'] == zone_id and
+                       query.get('type', x['type']) == x['type'] and query.get('name', x['name']) == x['name']]
+            return self.send(handler, 200, self.page(records, query))
+
+        if record_id == 'batch' and method == 'POST':
+            self.count(method, 'batch')
+            patches = [self.update(x['id'], x) for x in body.get('patches') or []]
+            return self.send(handler, 200, {'success': True, 'errors': [], 'result': {'patches': patches}})
+
+        if record_id in self.records and method in ('PUT', 'PATCH'):
+            self.count(method, 'dns_record')
+            return self.send(handler, 200, {'success': True, 'errors': [], 'result': self.update(record_id, body)})
+
+        return self.send(handler, 404, {'success': False, 'errors': [{'message': 'Not found'}]})
+
+    def count(self, method, route):
+        with self._lock:
+            self.requests[method, route] += 1
+
+    def update(self, record_id, fields):
+        with self._lock:
+            record = self.records[record_id]
+            record.update((k, v) for k, v in fields.items() if k != 'id')
+            record['modified_on'] = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+            return dict(record)
+
+    @staticmethod
+    def page(items, query):
+        per_page = int(query.get('per_page', 100))
+        page = int(query.get('page', 1))
+        total_pages = max(1, (len(items) + per_page - 1) // per_page)
+        return {
+            'success': True, 'errors': [], 'result': items[(page - 1) * per_page:page * per_page],
+            'result_info': {'page': page, 'per_page': per_page, 'total_pages': total_pages, 'count': len(items),
+                            'total_count': len(items)},
+        }
+
+    @staticmethod
+    def send(handler, status, body, content_type='application/json', headers=None):
+        data = body.encode() if isinstance(body, str) else json.dumps(body).encode()
+        handler.send_response(status)
+        handler.send_header('Content-Type', content_type)
+        handler.send_header('Content-Length', str(len(data)))
+        for key, value in (headers or {}).items():
+            handler.send_header(key, value)
+        handler.end_headers()
+        handler.wfile.write(data)
+
+
+def reset_client(api=None):
+    """Forget what the client learned, like a fresh start: the zone ids with the zones listing mark,
+    the applied IP's, the external IP's and the statistics of the IP services
+
+    :param api: MockCloudflareAPI, its request counters are reset too
+    :return:
+    """
+    from cloudflare_ddns.Cloudflare import Cloudflare
+    from cloudflare_ddns.utils.ips import clear_ip_cache, provider_stats
+
+    Cloudflare.applied_state.clear()
+    Cloudflare.zone_cache.clear()
+    clear_ip_cache()
+    provider_stats.reset()
+    if api is not None:
+        api.reset_counters()
+
+
+def engines():
+    """The engines that can run here, the asyncio engine requires aiohttp
+
+    :return: list of SCHEDULE_ENGINE values
+    """
+    try:
+        import aiohttp  # noqa: F401
+    except ImportError:
+        print('asyncio  skipped, aiohttp is not installed')
+        return ['schedule']
+    return ['schedule', 'asyncio']
+
+
+def sweep(engine):
+    """Run a single sweep of the plan of the settings, like --update-now without closing the sessions
+
+    :param engine: schedule or asyncio
+    :return:
+    """
+    import main
+
+    if engine == 'asyncio':
+        asyncio.run(main.cloudflare_async_once())
+    else:
+        main.cloudflare_sweep()
+        main.shutdown_executors()
+
+
+def check_requests(api, engine, expected):
+    """Compare the requests counted since the last reset with the expected ones
+
+    :param api: MockCloudflareAPI
+    :param engine: used in the messages
+    :param expected: dict with (method, route) as key and the number of requests as value
+    :return: list of the failed checks
+    """
+    print('%-8s %s' % (engine, dict(api.requests)))
+    return ['%s: %d %s %s requests, expected %d' % (engine, api.requests[key], key[0], key[1], count)
+            for key, count in expected.items() if api.requests[key] != count]
+
+
+def report(errors):
+    """Print the failed checks
+
+    :param errors: list of the failed checks
+    :return: the exit status of the script
+    """
+    for error in errors:
+        print('FAILED', error)
+    return 1 if errors else 0
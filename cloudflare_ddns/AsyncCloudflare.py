@@ -0,0 +1,491 @@
+#  -*- coding: utf-8 -*-
+#
+#              Copyright (C) 2018-2021 ProGeek
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import time
+import asyncio
+import logging
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+from cloudflare_ddns.core.exceptions import ImproperlyConfigured, CloudflareAPIError
+from cloudflare_ddns.Cloudflare import (Cloudflare, DEFAULT_ACCOUNT, auth_headers, account_credentials,
+                                        zone_cache_key, zones_listed, save_zones, index_dns_records, dns_records_filters,
+                                        pending_records, record_ip_address, plan_update, record_updated, batch_api,
+                                        batches)
+from cloudflare_ddns.utils.ratelimit import get_limiter, observe_headers, backoff_delay
+from cloudflare_ddns.utils import metrics
+from cloudflare_ddns.utils.ips import (get_cached_ip, cache_ip, parse_cf_trace, get_local_ipv6, clean_public_ip,
+                                      provider_stats)
+from cloudflare_ddns.utils.providers import Hedge
+from cloudflare_ddns.conf import settings
+
+log = logging.getLogger('cf_logging')
+
+
+class AsyncCloudflare(object):
+    """Asyncio counterpart of the Cloudflare client, built on aiohttp
+
+    All the requests of a sweep run concurrently, at most `concurrency` at the same time.
+    Use it as an async context manager, so the HTTP session is closed at the end:
+
+        async with AsyncCloudflare() as cf:
+            await cf.update_zone_records(zone, records, ip_addresses)
+    """
+
+    endpoint = getattr(settings, 'CLOUDFLARE_ENDPOINT_API')
+
+    # the zone cache is shared with the threaded client
+    zone_cache = Cloudflare.zone_cache
+    applied_state = Cloudflare.applied_state
+
+    def __init__(self, concurrency=None, **kwargs):
+        if aiohttp is None:
+            raise ImproperlyConfigured("The asyncio engine requires the aiohttp package: pip install aiohttp")
+
+        self.concurrency = concurrency or getattr(settings, 'ASYNC_CONCURRENCY')
+        self.account = kwargs.get('account') or DEFAULT_ACCOUNT
+
+        credentials = account_credentials(self.account)
+        credentials.update(kwargs)
+        self.headers = auth_headers(**credentials)
+
+        self.session = kwargs.get('session')
+        self.limiter = kwargs.get('limiter') or get_limiter(self.account)
+        self.semaphore = None
+        self._accounts = {}
+
+    async def __aenter__(self):
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        if self.session is None:
+            accounts = 1 + len(getattr(settings, 'CF_ACCOUNTS'))
+            connector = aiohttp.TCPConnector(limit=self.concurrency * accounts)
+            self.session = aiohttp.ClientSession(connector=connector)
+        return self
+
+    def for_account(self, account):
+        """The client of another account of CF_ACCOUNTS, it shares the HTTP session of this client
+
+        Each account has its own credentials, rate limit and `concurrency` requests at the same time.
+
+        :param account: name of the account, None is the default account
+        :return:
+        """
+        account = account or DEFAULT_ACCOUNT
+        if account == self.account:
+            return self
+
+        client = self._accounts.get(account)
+        if client is None:
+            client = AsyncCloudflare(self.concurrency, account=account, session=self.session)
+            client.semaphore = asyncio.Semaphore(self.concurrency)
+            self._accounts[account] = client
+        return client
+
+    def reload_credentials(self):
+        """Read the credentials of the accounts from the settings again, after they are reloaded
+
+        :return:
+        """
+        self.headers = auth_headers(**account_credentials(self.account))
+        self._accounts.clear()
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.session.close()
+
+    async def query_api(self, endpoint, method: str = "GET", json_body=None, params=None, cur_page: int = 1,
+                        timeout: float = 6.0):
+        """Query the Cloudflare API, same as Cloudflare.query_api
+
+        :param endpoint:
+        :param method: default method for request is GET
+        :param json_body:
+        :param params:
+        :param cur_page:
+        :param timeout:
+        :return:
+        """
+        dft_params = {}
+
+        if params is not None and method == 'GET':
+            dft_params = {'per_page': 50, 'page': cur_page}
+            dft_params.update(params)
+
+        max_retries = getattr(settings, 'CF_MAX_RETRIES')
+        for attempt in range(max_retries + 1):
+            delay = self.limiter.reserve()
+            if delay:
+                await asyncio.sleep(delay)
+
+            async with self.semaphore:
+                start = time.perf_counter()
+                try:
+                    async with self.session.request(method, endpoint, headers=self.headers, json=json_body,
+                                                    params=dft_params,
+                                                    timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+                        metrics.api_latency.observe(time.perf_counter() - start, method=method,
+                                                    endpoint=metrics.endpoint_label(endpoint))
+                        metrics.api_responses.inc(method=method, status=response.status)
+                        retry_after = observe_headers(self.limiter, response.headers)
+                        body = await response.json(content_type=None)
+                        if response.status < 400:
+                            return body
+                except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                    log.error("📈 Error sending '%s' request to '%s': %s", method, endpoint, e)
+                    return None
+
+            if response.status != 429:
+                break
+            metrics.api_rate_limited.inc()
+            if attempt == max_retries:
+                break
+            if retry_after is None:
+                retry_after = backoff_delay(attempt)
+            log.warning("🚦 Cloudflare API rate limit reached, retrying in %.1f seconds", retry_after)
+            self.limiter.pause(retry_after)
+
+        log.error("📈 Error sending '%s' request to '%s': %s", method, response.url, body,
+                  extra={'status': response.status})
+        errors = [x.get("message") for x in (body or {}).get("errors") or []]
+        errors.append(json_body)
+        for e in [x for x in errors if x]:
+            log.error(e)
+        return None
+
+    async def get_zones_ids(self, zone=None):
+        """Get zone id for all the zones present on the Cloudflare account, or only for a specific zone
+
+        :param zone: name of the zone, or domain name
+        :return:
+        """
+        data = {} if zone is None else {'name': zone}
+
+        cur_page = 1
+        zone_names_to_ids = {}
+
+        log.info('Get Cloudflare zones id\'s for zone %s', zone)
+        while True:
+            zone_response = await self.query_api(getattr(settings, "CLOUDFLARE_ZONE_API"), "GET", params=data,
+                                                 cur_page=cur_page)
+            if not zone_response:
+                return None
+
+            total_pages = zone_response['result_info']['total_pages']
+            for item in zone_response['result']:
+                zone_names_to_ids[item['name']] = item['id']
+            if cur_page < total_pages:
+                cur_page += 1
+            else:
+                break
+        return zone_names_to_ids
+
+    async def get_zone_id(self, zone):
+        """Get the zone id for a zone name, from the zone cache when is possible
+
+        :param zone: name of the zone, or domain name
+        :return:
+        """
+        zone_id = self.zone_cache.get(zone_cache_key(self.account, zone))
+        if zone_id is None and await self.list_zones():
+            zone_id = self.zone_cache.get(zone_cache_key(self.account, zone))
+        if zone_id is None:
+            zones_ids = await self.get_zones_ids(zone)
+            if not zones_ids:
+                return None
+            self.zone_cache.update({zone_cache_key(self.account, k): v for k, v in zones_ids.items()})
+            zone_id = zones_ids.get(zone)
+        return zone_id
+
+    async def list_zones(self):
+        """Fill the zone cache with all the zones of the account, same as Cloudflare.list_zones
+
+        :return: True when zones missing from the zone cache were found
+        """
+        if zones_listed(self.account):
+            return False
+        zones_ids = await self.get_zones_ids()
+        if zones_ids is None:
+            return False
+        return save_zones(self.account, zones_ids)
+
+    async def iter_dns_records(self, zone_id, record_type=None, name=None):
+        """Stream all the DNS records of a zone, page by page, same as Cloudflare.iter_dns_records
+
+        :param zone_id:
+        :param record_type: return only the records of this type
+        :param name: return only the records with this name
+        :return: async generator of DNS records
+        :raise CloudflareAPIError: when a page can't be fetched
+        """
+        params = {'per_page': getattr(settings, 'CF_DNS_RECORDS_PER_PAGE')}
+        if record_type:
+            params['type'] = record_type
+        if name:
+            params['name'] = name
+
+        cur_page = 1
+        while True:
+            dns_records_response = await self.query_api(
+                getattr(settings, 'CLOUDFLARE_ZONE_DNS_RECORDS_QUERY_API').format(zone_id=zone_id),
+                params=params, cur_page=cur_page)
+            if not dns_records_response:
+                raise CloudflareAPIError("DNS records of zone %s can't be fetched" % zone_id)
+
+            for dns_record in dns_records_response['result']:
+                yield dns_record
+
+            if cur_page < dns_records_response['result_info']['total_pages']:
+                cur_page += 1
+            else:
+                break
+
+    async def get_dns_records(self, zone_id, record_type=None, name=None):
+        """Get the DNS records of a zone, indexed by zone id, type and name
+
+        :param zone_id:
+        :param record_type: fetch only the records of this type
+        :param name: fetch only the records with this name
+        :return: the indexed DNS records or None when they can't be fetched
+        """
+        try:
+            return index_dns_records([x async for x in self.iter_dns_records(zone_id, record_type, name)])
+        except CloudflareAPIError as e:
+            log.error(e)
+            return None
+
+    async def update_zone_records(self, zone, records, ip_addresses=None):
+        """Update all the configured DNS records of a zone, the updates run concurrently
+
+        :param zone: name of the zone, or domain name
+        :param records: Record of the plan that belong to the zone
+        :param ip_addresses: IP address already resolved for each record type
+        :return:
+        """
+        ip_addresses = ip_addresses or {}
+
+        records = pending_records(self.applied_state, records, ip_addresses)
+        if not records:
+            log.info('⚌ All DNS records of %s already have the external IP; taking no action', zone)
+            return None
+
+        zone_id = await self.get_zone_id(zone)
+        if not zone_id:
+            log.error('∅ No zone found for %s', zone)
+            metrics.records.inc(len(records), result='failed')
+            return None
+
+        zone_dns_records = await self.get_dns_records(zone_id, **dns_records_filters(records))
+        if zone_dns_records is None:
+            # the cached zone id may be stale, it will be fetched again on the next update
+            self.zone_cache.delete(zone_cache_key(self.account, zone))
+            metrics.records.inc(len(records), result='failed')
+            return None
+
+        updates = []
+        for x in records:
+            update = plan_update(self.applied_state, zone_dns_records, zone, zone_id, x.name, x.record_type,
+                                 record_ip_address(x, ip_addresses), x.ttl, x.proxied)
+            if update:
+                updates.append(update)
+
+        if updates:
+            await self.update_dns_records(zone_id, updates)
+
+    async def update_dns_record(self, record, payload):
+        """Update a single DNS record
+
+        :param record: the DNS record to update
+        :param payload: the new values of the record
+        :return:
+        """
+        log.info("📡 Updating DNS record %s", record.get('name'))
+
+        api_endpoint = getattr(settings, 'CLOUDFLARE_ZONE_DNS_RECORDS_UPDATE_API').format(
+                zone_id=record['zone_id'], dns_record_id=record['id'])
+
+        start = time.perf_counter()
+        update_record_response = await self.query_api(api_endpoint, method='PATCH', json_body=payload)
+        record_updated(self.applied_state, record, payload,
+                       update_record_response and (update_record_response.get('result') or record),
+                       time.perf_counter() - start)
+
+    async def update_dns_records(self, zone_id, updates):
+        """Update many DNS records of a zone with the batch endpoint, record by record when the batch fails
+
+        :param zone_id:
+        :param updates: list of (record, payload)
+        :return:
+        """
+        if len(updates) == 1 or not getattr(settings, 'CF_BATCH_UPDATES'):
+            await asyncio.gather(*(self.update_dns_record(record, payload) for record, payload in updates))
+            return
+
+        api_endpoint = batch_api(zone_id)
+
+        for batch in batches(updates, getattr(settings, 'CF_BATCH_SIZE')):
+            log.info("📡 Updating %d DNS records in a single batch", len(batch))
+
+            body = {'patches': [dict(payload, id=record['id']) for record, payload in batch]}
+            start = time.perf_counter()
+            batch_response = await self.query_api(api_endpoint, method='POST', json_body=body)
+            duration = time.perf_counter() - start
+            if not batch_response:
+                log.warning("📡 Batch update failed, updating the DNS records one by one")
+                await asyncio.gather(*(self.update_dns_record(record, payload) for record, payload in batch))
+                continue
+
+            results = {x.get('id'): x for x in (batch_response.get('result') or {}).get('patches') or []}
+            for record, payload in batch:
+                record_updated(self.applied_state, record, payload, results.get(record['id'], record), duration)
+
+    async def fetch_text(self, url, timeout=10):
+        """GET an external IP service and return the body
+
+        :param url:
+        :param timeout:
+        :return: the body or None when the service is not reachable
+        """
+        async with self.semaphore:
+            try:
+                async with self.session.get(url, timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+                    response.raise_for_status()
+                    return await response.text()
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                return None
+
+    async def probe(self, api, version=4, parse=None, timeout=10):
+        """Ask an external service for the IP address, same as ips.probe
+
+        :param api: URL of the service
+        :param version: 4 or 6, the IP version expected
+        :param parse: function that extracts the IP from the body, the whole body is the IP by default
+        :param timeout:
+        :return: the public IP address, None if the service is not reachable or the answer isn't one
+        """
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        text = await self.fetch_text(api, timeout=timeout)
+        ip_address = clean_public_ip((parse(text) if parse else text) or '', version=version) if text else None
+
+        latency = loop.time() - start
+        if ip_address:
+            provider_stats.record_success(api, latency)
+        else:
+            provider_stats.record_failure(api, latency)
+        result = 'success' if ip_address else 'failure' if text else 'error'
+        metrics.ip_probe_latency.observe(latency, provider=api, result=result)
+        return ip_address
+
+    async def get_ipv4_address(self, quorum=None, timeout=None):
+        """Query the EXTERNAL_IPV4_QUERY_APIS ranked and hedged, same as ips.get_ipv4_address
+
+        The queries still running are cancelled as soon as the quorum is reached.
+
+        :param quorum: how many services must report the same IP, default EXTERNAL_IPV4_QUORUM
+        :param timeout: seconds to wait for the services, default EXTERNAL_IP_QUERY_TIMEOUT
+        :return:
+        """
+        hedge = Hedge(provider_stats.rank(settings.EXTERNAL_IPV4_QUERY_APIS),
+                      quorum or settings.EXTERNAL_IPV4_QUORUM)
+        if not hedge.count:
+            return None
+
+        loop = asyncio.get_running_loop()
+        timeout = timeout or settings.EXTERNAL_IP_QUERY_TIMEOUT
+        deadline = loop.time() + timeout
+        tasks = {}
+
+        def query(apis):
+            for api in apis:
+                log.info("Fetching %s", api)
+                tasks[asyncio.ensure_future(self.probe(api, 4, None, timeout))] = api
+
+        query(hedge.first())
+
+        try:
+            pending = set(tasks)
+            while pending:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    log.error('External IPv4 services did not answer in %s seconds', timeout)
+                    break
+
+                done, pending = await asyncio.wait(pending, timeout=min(settings.EXTERNAL_IP_HEDGE_DELAY, remaining),
+                                                   return_when=asyncio.FIRST_COMPLETED)
+                failed = 0
+                for task in done:
+                    ip_address = task.result()
+                    if not ip_address:
+                        log.error('%s did not answer with a public IPv4 address', tasks[task])
+
+                    if hedge.answered(ip_address):
+                        log.info("External IPv4 %s confirmed by %d of %d services", ip_address, hedge.quorum,
+                                 hedge.count)
+                        return ip_address
+                    failed += not ip_address
+
+                # hedge: replace the failed services, and query one more when nothing answered in time
+                query(hedge.next(failed, not done))
+                pending = {x for x in tasks if not x.done()}
+        finally:
+            for task in tasks:
+                task.cancel()
+
+        log.error('🧩 No external IPv4 reported by %d services: %s', hedge.quorum, dict(hedge.votes))
+        return None
+
+    async def get_external_ip(self, record_type='A'):
+        """Get the external IP address used for a DNS record type, same as ips.get_external_ip
+
+        :param record_type: A for the IPv4 address or AAAA for the IPv6 address
+        :return:
+        """
+        ip_address = get_cached_ip(record_type)
+        if ip_address:
+            return ip_address
+
+        if record_type == 'A':
+            if settings.QUERY_CF_FOR_EXTERNAL_IP and provider_stats.is_available(settings.EXTERNAL_CF_IPV4_QUERY_API):
+                log.info("Fetching IPv4 IP from: %s", settings.EXTERNAL_CF_IPV4_QUERY_API)
+                ip_address = await self.probe(settings.EXTERNAL_CF_IPV4_QUERY_API, version=4, parse=parse_cf_trace)
+                if not ip_address:
+                    log.error("🧩 Cloudflare IPv4 not detected")
+            if not ip_address:
+                ip_address = await self.get_ipv4_address()
+        elif record_type == 'AAAA' and settings.IPV6_SOURCE == 'interface':
+            ip_address = get_local_ipv6(settings.IPV6_INTERFACE, settings.IPV6_PREFIXES)
+        elif record_type == 'AAAA':
+            log.info("Fetching IPv6 IP from: %s", settings.EXTERNAL_CF_IPV6_QUERY_API)
+            ip_address = await self.probe(settings.EXTERNAL_CF_IPV6_QUERY_API, version=6, parse=parse_cf_trace)
+            if not ip_address:
+                log.error("🧩 Cloudflare IPv6 not detected")
+
+        if ip_address:
+            cache_ip(record_type, ip_address)
+        return ip_address
+
+    async def resolve_external_ips(self, record_types=('A', 'AAAA')):
+        """Resolve concurrently the external IP address for each DNS record type of a sweep
+
+        :param record_types: DNS record types that will be updated
+        :return: dict with the IP address for every record type, None if it can't be detected
+        """
+        record_types = list(set(record_types))
+        ip_addresses = await asyncio.gather(*(self.get_external_ip(x) for x in record_types))
+        return dict(zip(record_types, ip_addresses))
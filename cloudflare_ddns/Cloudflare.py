@@ -15,22 +15,30 @@
 #  You should have received a copy of the GNU General Public License
 #  along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import time
 import logging
 import threading
 import signal
 import json
-import requests
 
 from typing import Optional
 
-import tld
-
-from cloudflare_ddns.core.exceptions import ImproperlyConfigured
-from cloudflare_ddns.utils.ips import get_cf_ipv4, get_cf_ipv6, get_ipv4_address
+from cloudflare_ddns.core.constants import DEFAULT_ACCOUNT
+from cloudflare_ddns.core.exceptions import ImproperlyConfigured, CloudflareAPIError
+from cloudflare_ddns.utils.ips import get_external_ip
+from cloudflare_ddns.utils.cache import TTLCache
+from cloudflare_ddns.utils.http import get_session
+from cloudflare_ddns.utils.ratelimit import get_limiter, observe_headers, backoff_delay
+from cloudflare_ddns.utils import metrics
+from cloudflare_ddns.utils.records import RecordStore, parse_domain
+from cloudflare_ddns.utils.state import AppliedState
 from cloudflare_ddns.conf import settings
 
 log = logging.getLogger('cf_logging')
 
+# zone cache key, for each account, of the time all the zones were listed. It is not a valid zone name
+ZONES_LISTED = '*'
+
 
 class GracefulExit:
     def __init__(self):
@@ -43,43 +51,330 @@ class GracefulExit:
         self.kill_now.set()
 
 
+def auth_headers(**kwargs):
+    """HTTP headers that authenticate the requests to the Cloudflare API
+
+    :param kwargs: auth_type, email, api_key and api_token, default values are read from settings
+    :return:
+    """
+    kw_auth_type = kwargs.get('auth_type', getattr(settings, 'CF_AUTH_TYPE'))
+
+    kw_email = kwargs.get('email', getattr(settings, 'CF_EMAIL'))
+    kw_api_key = kwargs.get('api_key', getattr(settings, 'CF_API_KEY'))
+    kw_api_token = kwargs.get('api_token', getattr(settings, 'CF_API_TOKEN'))
+
+    if kw_auth_type == 'token':
+        bearer = str("Bearer " + kw_api_token)
+        return {
+            'Content-Type': 'application/json',
+            'Authorization': bearer
+        }
+    elif kw_auth_type == 'key':
+        if kw_email and kw_api_key:
+            return {
+                'Content-Type': 'application/json',
+                'X-Auth-Email': kw_email,
+                'X-Auth-Key': kw_api_key
+            }
+        else:
+            raise ImproperlyConfigured("The email for api key is missing from configuration")
+    raise ImproperlyConfigured("The CF_AUTH_TYPE setting must be token or key")
+
+
+def account_credentials(account=DEFAULT_ACCOUNT):
+    """Credentials of an account profile of CF_ACCOUNTS, as auth_headers arguments
+
+    :param account: name of the profile, the default account uses the CF_* settings
+    :return:
+    """
+    if not account or account == DEFAULT_ACCOUNT:
+        return {}
+    accounts = getattr(settings, 'CF_ACCOUNTS')
+    if account not in accounts:
+        raise ImproperlyConfigured("The Cloudflare account %s is missing from CF_ACCOUNTS" % account)
+    return dict(accounts[account])
+
+
+def zone_cache_key(account, zone):
+    """Key of a zone id in the zone cache, the same zone name may belong to different accounts
+
+    :param account:
+    :param zone:
+    :return:
+    """
+    if account == DEFAULT_ACCOUNT:
+        return zone
+    return '%s/%s' % (account, zone)
+
+
+def known_zones(account=DEFAULT_ACCOUNT):
+    """Names of the zones of an account already in the zone cache
+
+    :param account:
+    :return: set of zone names
+    """
+    keys = Cloudflare.zone_cache.keys()
+    if account == DEFAULT_ACCOUNT:
+        return {x for x in keys if '/' not in x and x != ZONES_LISTED}
+    prefix = zone_cache_key(account, '')
+    return {x[len(prefix):] for x in keys if x.startswith(prefix) and x != prefix + ZONES_LISTED}
+
+
+def zones_listed(account=DEFAULT_ACCOUNT):
+    """Whether all the zones of an account are in the zone cache, the mark expires with the zone ids
+
+    :param account:
+    :return:
+    """
+    return Cloudflare.zone_cache.get(zone_cache_key(account, ZONES_LISTED)) is not None
+
+
+def save_zones(account, zones_ids):
+    """Put all the zones of an account in the zone cache, and mark them as listed
+
+    The mark is saved in the CF_ZONE_CACHE_FILE with the zone ids, so a restart doesn't list the zones again.
+
+    :param account:
+    :param zones_ids: zone name to zone id of all the zones of the account
+    :return: True when zones missing from the zone cache were found
+    """
+    before = known_zones(account)
+    entries = {zone_cache_key(account, k): v for k, v in zones_ids.items()}
+    entries[zone_cache_key(account, ZONES_LISTED)] = int(time.time())
+    Cloudflare.zone_cache.update(entries)
+    return not before.issuperset(zones_ids)
+
+
+def flush_caches():
+    """Write the zone cache and the applied state to their files, when they changed
+
+    :return:
+    """
+    Cloudflare.zone_cache.flush()
+    Cloudflare.applied_state.flush()
+
+
+def index_dns_records(result):
+    """Index the DNS records returned by Cloudflare by zone id, type and name
+
+    :param result: iterable of DNS records from the Cloudflare API
+    :return: RecordStore
+    """
+    return RecordStore(result)
+
+
+def dns_records_filters(records):
+    """Filters that limit the listing of the zone DNS records to the configured records
+
+    The API filters only on a single type or name, so a filter is used only when all
+    the records share it.
+
+    :param records: Record of the plan that belong to the same zone
+    :return: dict with the record_type and name filters
+    """
+    filters = {}
+    record_types = {x.record_type for x in records}
+    if len(record_types) == 1:
+        filters['record_type'] = record_types.pop()
+    names = {x.name for x in records}
+    if len(names) == 1:
+        filters['name'] = names.pop()
+    return filters
+
+
+def find_record(zone_dns_records, zone, zone_id, subdomain, record_type):
+    """Find the Cloudflare DNS record for a subdomain in the zone DNS records
+
+    :param zone_dns_records: zone DNS records as returned by index_dns_records
+    :param zone: name of the zone
+    :param zone_id:
+    :param subdomain:
+    :param record_type: A or AAAA
+    :return: the DNS record or None when is missing
+    """
+    if record_type not in ('A', 'AAAA'):
+        log.error('∅ DNS record type %s is not supported for %s', record_type, subdomain,
+                  extra={'record': subdomain, 'record_type': record_type, 'zone': zone})
+        return None
+
+    # check if Cloudflare has any records of this type
+    if not zone_dns_records.count(zone_id, record_type):
+        log.error('∅ No %s zone DNS records found for %s', record_type, zone,
+                  extra={'record': subdomain, 'record_type': record_type, 'zone': zone})
+        return None
+
+    # check if the zone dns record exist
+    record = zone_dns_records.get(zone_id, record_type, subdomain)
+    if not record:
+        log.error('∅ No DNS %s record found with this name: %s', record_type, subdomain,
+                  extra={'record': subdomain, 'record_type': record_type, 'zone': zone})
+        return None
+
+    return record
+
+
+def pending_records(applied_state, records, ip_addresses):
+    """The DNS records that don't have the external IP applied yet, or that need a verification
+
+    :param applied_state: AppliedState
+    :param records: Record of the plan
+    :param ip_addresses: IP address resolved for each record type
+    :return:
+    """
+    pending = [x for x in records
+               if not applied_state.is_applied(x.record_type, x.name, record_ip_address(x, ip_addresses))]
+    metrics.records.inc(len(records) - len(pending), result='skipped')
+    return pending
+
+
+def record_ip_address(record, ip_addresses):
+    """The IP address of a Record of the plan, its own one or the external IP of its type
+
+    :param record:
+    :param ip_addresses: IP address resolved for each record type
+    :return:
+    """
+    return record.ip_address or ip_addresses.get(record.record_type)
+
+
+def record_payload(subdomain, record_type, ip_address, ttl, proxied):
+    """Body of the request that updates a DNS record
+
+    :return:
+    """
+    return {'type': record_type, 'name': subdomain, 'ttl': int(ttl), 'content': ip_address, 'proxied': bool(proxied)}
+
+
+def plan_update(applied_state, zone_dns_records, zone, zone_id, subdomain, record_type, ip_address, ttl, proxied):
+    """Compare a DNS record with the zone DNS records fetched from Cloudflare
+
+    :param applied_state: AppliedState, updated when the record is already up-to-date
+    :param zone_dns_records: zone DNS records as returned by index_dns_records
+    :param zone: name of the zone
+    :param zone_id:
+    :param subdomain:
+    :param record_type: A or AAAA
+    :param ip_address:
+    :param ttl: Time to live for DNS record. Value of 1 is 'automatic'
+    :param proxied: Whether the record is receiving the performance and security benefits of Cloudflare
+    :return: (record, payload) when the record must be updated, None otherwise
+    """
+    record = find_record(zone_dns_records, zone, zone_id, subdomain, record_type)
+    if not record or not ip_address:
+        metrics.records.inc(result='failed')
+        return None
+
+    metrics.records.inc(result='checked')
+    changes = record_changes(record, record_payload(subdomain, record_type, ip_address, ttl, proxied))
+    if not changes:
+        metrics.records.inc(result='skipped')
+        log.info('⚌ DNS record %s is already up-to-date; taking no action, last modified on %s',
+                 subdomain, record.get('modified_on'),
+                 extra={'record': subdomain, 'record_type': record_type, 'zone': zone, 'new_ip': ip_address})
+        applied_state.remember(record, ip_address)
+        return None
+
+    return record, changes
+
+
+def record_changes(record, payload):
+    """Fields of the payload that differ from the DNS record fetched from Cloudflare
+
+    The type and name are left out, the record was found by them. The TTL of a proxied
+    record is always automatic, so it is not compared either.
+
+    :param record: the DNS record as returned by Cloudflare
+    :param payload: the desired record as returned by record_payload
+    :return: the body of a PATCH request, empty when the record is up-to-date
+    """
+    ignored = ('type', 'name', 'ttl') if payload.get('proxied') else ('type', 'name')
+    return {key: value for key, value in payload.items() if key not in ignored and record.get(key) != value}
+
+
+def record_updated(applied_state, record, payload, result, duration=None):
+    """Log the outcome of a DNS record update and save it in the applied state
+
+    :param applied_state: AppliedState
+    :param record: the DNS record before the update
+    :param payload: body of the update request
+    :param result: the DNS record returned by Cloudflare, None when the update failed
+    :param duration: seconds taken by the update request
+    :return:
+    """
+    ip_address = payload.get('content', record.get('content'))
+    fields = {'record': record['name'], 'record_type': record['type'], 'zone': record.get('zone_name'),
+              'old_ip': record.get('content'), 'new_ip': ip_address, 'duration': duration}
+    if result:
+        log.info('😀 The DNS record for %s updated with new IP: %s', record['name'], ip_address, extra=fields)
+        applied_state.remember(result, ip_address)
+        metrics.records.inc(result='updated')
+    else:
+        log.error('❌ DNS record %s failed to update', record['name'], extra=fields)
+        metrics.records.inc(result='failed')
+        applied_state.forget(record['type'], record['name'])
+
+
+def batch_api(zone_id):
+    """URL of the batch endpoint of a zone
+
+    A settings.py older than the batch updates has no CLOUDFLARE_ZONE_DNS_RECORDS_BATCH_API,
+    then the URL is the one of the zone DNS records followed by /batch.
+
+    :param zone_id:
+    :return:
+    """
+    url = getattr(settings, 'CLOUDFLARE_ZONE_DNS_RECORDS_BATCH_API', None)
+    if not url:
+        url = getattr(settings, 'CLOUDFLARE_ZONE_DNS_RECORDS_QUERY_API').rstrip('/') + '/batch'
+    return url.format(zone_id=zone_id)
+
+
+def batches(updates, size):
+    """Split the updates in chunks of at most `size` items
+
+    :param updates:
+    :param size:
+    :return:
+    """
+    for i in range(0, len(updates), size):
+        yield updates[i:i + size]
+
+
 class Cloudflare(object):
 
     endpoint = getattr(settings, 'CLOUDFLARE_ENDPOINT_API')
 
+    # zone name to zone id, shared by all the instances
+    zone_cache = TTLCache(ttl=getattr(settings, 'CF_ZONE_CACHE_TTL'), path=getattr(settings, 'CF_ZONE_CACHE_FILE'))
+
+    # last IP address applied to each DNS record, shared by all the instances
+    applied_state = AppliedState(ttl=getattr(settings, 'CF_FORCE_VERIFY_INTERVAL'),
+                                 path=getattr(settings, 'CF_STATE_FILE'))
+
     def __init__(self, **kwargs):
-        kw_auth_type = kwargs.get('auth_type', getattr(settings, 'CF_AUTH_TYPE'))
+        # keep-alive connections shared with the other instances and the IP probes
+        self.session = kwargs.get('session') or get_session()
 
-        kw_email = kwargs.get('email', getattr(settings, 'CF_EMAIL'))
-        kw_api_key = kwargs.get('api_key', getattr(settings, 'CF_API_KEY'))
-        kw_api_token = kwargs.get('api_token', getattr(settings, 'CF_API_TOKEN'))
+        # each account has its own credentials and rate limit budget
+        self.account = kwargs.get('account') or DEFAULT_ACCOUNT
+        self.limiter = kwargs.get('limiter') or get_limiter(self.account)
 
-        if kw_auth_type == 'token':
-            bearer = str("Bearer " + kw_api_token)
-            self.headers = {
-                'Content-Type': 'application/json',
-                'Authorization': bearer
-            }
-        elif kw_auth_type == 'key':
-            if kw_email and kw_api_key:
-                self.headers = {
-                    'Content-Type': 'application/json',
-                    'X-Auth-Email': kw_email,
-                    'X-Auth-Key': kw_api_key
-                }
-            else:
-                raise ImproperlyConfigured("The email for api key is missing from configuration")
+        credentials = account_credentials(self.account)
+        credentials.update(kwargs)
+        self.headers = auth_headers(**credentials)
 
-    def __call__(self, subdomain, record_type, ttl, proxied):
+    def __call__(self, subdomain, record_type, ttl, proxied, ip_address=None):
         """
 
         :param subdomain:
         :param subdomain:
         :param ttl:
         :param proxied:
+        :param ip_address: IP address already resolved for this sweep
         :return:
         """
-        self.update_record(subdomain=subdomain, record_type=record_type, ttl=ttl, proxied=proxied)
+        self.update_record(subdomain=subdomain, record_type=record_type, ip_address=ip_address, ttl=ttl,
+                           proxied=proxied)
 
     def query_api(self, endpoint, method: str = "GET", json_body=None, params=None, cur_page: int = 1,
                   timeout: float = 6.0):
@@ -96,23 +391,45 @@ class Cloudflare(object):
 
         dft_params = {}
 
-        if params and method == 'GET':
+        if params is not None and method == 'GET':
             dft_params = {'per_page': 50, 'page': cur_page}
             dft_params.update(params)
 
-        response = requests.request(
-            method=method,
-            url=endpoint,
-            headers=self.headers,
-            timeout=timeout,
-            json=json_body,
-            params=dft_params
-        )
+        max_retries = getattr(settings, 'CF_MAX_RETRIES')
+        for attempt in range(max_retries + 1):
+            delay = self.limiter.reserve()
+            if delay:
+                time.sleep(delay)
+
+            start = time.perf_counter()
+            response = self.session.request(
+                method=method,
+                url=endpoint,
+                headers=self.headers,
+                timeout=timeout,
+                json=json_body,
+                params=dft_params
+            )
+            metrics.api_latency.observe(time.perf_counter() - start, method=method,
+                                        endpoint=metrics.endpoint_label(endpoint))
+            metrics.api_responses.inc(method=method, status=response.status_code)
+
+            retry_after = observe_headers(self.limiter, response.headers)
+            if response.status_code != 429:
+                break
+            metrics.api_rate_limited.inc()
+            if attempt == max_retries:
+                break
+            if retry_after is None:
+                retry_after = backoff_delay(attempt)
+            log.warning("🚦 Cloudflare API rate limit reached, retrying in %.1f seconds", retry_after)
+            self.limiter.pause(retry_after)
 
         if response.ok:
             return response.json()
         else:
-            log.error("📈 Error sending '" + method + "' request to '" + response.url + "': " + response.text)
+            log.error("📈 Error sending '%s' request to '%s': %s", method, response.url, response.text,
+                      extra={'status': response.status_code})
             errors = [x.get("message") for x in response.json().get("errors")]
             errors.append(json_body)
             for e in [x for x in errors if x]:
@@ -144,7 +461,7 @@ class Cloudflare(object):
         cur_page = 1
         zone_names_to_ids = {}
 
-        log.info('Get Cloudflare zones id\'s for zone %s' % zone)
+        log.info('Get Cloudflare zones id\'s for zone %s', zone)
         while True:
             zone_response = self.query_api(getattr(settings, "CLOUDFLARE_ZONE_API"), "GET", params=data, cur_page=cur_page)
             if not zone_response:
@@ -159,29 +476,83 @@ class Cloudflare(object):
                 break
         return zone_names_to_ids
 
-    def get_dns_records(self, zone_id):
+    def get_zone_id(self, zone):
+        """Get the zone id for a zone name, from the zone cache when is possible
+
+        :param zone: name of the zone, or domain name
+        :return:
         """
+        zone_id = self.zone_cache.get(zone_cache_key(self.account, zone))
+        if zone_id is None and self.list_zones():
+            zone_id = self.zone_cache.get(zone_cache_key(self.account, zone))
+        if zone_id is None:
+            zones_ids = self.get_zones_ids(zone)
+            if not zones_ids:
+                return None
+            self.zone_cache.update({zone_cache_key(self.account, k): v for k, v in zones_ids.items()})
+            zone_id = zones_ids.get(zone)
+        return zone_id
+
+    def list_zones(self):
+        """Fill the zone cache with all the zones of the account, at most once every CF_ZONE_CACHE_TTL
+
+        A zone delegated below a registered domain, like sub.example.com, can't be found from
+        the public suffix list, only from the list of the zones of the account.
+
+        :return: True when zones missing from the zone cache were found
+        """
+        if zones_listed(self.account):
+            return False
+        zones_ids = self.get_zones_ids()
+        if zones_ids is None:
+            return False
+        return save_zones(self.account, zones_ids)
+
+    def iter_dns_records(self, zone_id, record_type=None, name=None):
+        """Stream all the DNS records of a zone, page by page
+
+        The filters are applied by Cloudflare, so only the matching records are transferred.
 
         :param zone_id:
-        :return:
+        :param record_type: return only the records of this type
+        :param name: return only the records with this name
+        :return: generator of DNS records
+        :raise CloudflareAPIError: when a page can't be fetched
         """
+        params = {'per_page': getattr(settings, 'CF_DNS_RECORDS_PER_PAGE')}
+        if record_type:
+            params['type'] = record_type
+        if name:
+            params['name'] = name
 
-        dns_records = {
-            'A': {},
-            'AAAA': {}
-        }
-        dns_records_response = self.query_api(
-            getattr(settings, 'CLOUDFLARE_ZONE_DNS_RECORDS_QUERY_API').format(zone_id=zone_id))
+        cur_page = 1
+        while True:
+            dns_records_response = self.query_api(
+                getattr(settings, 'CLOUDFLARE_ZONE_DNS_RECORDS_QUERY_API').format(zone_id=zone_id),
+                params=params, cur_page=cur_page)
+            if not dns_records_response:
+                raise CloudflareAPIError("DNS records of zone %s can't be fetched" % zone_id)
+
+            yield from dns_records_response['result']
 
-        for dns_record in dns_records_response['result']:
-            dns_type = dns_record['type']
-            name = tld.get_tld(dns_record['name'], fix_protocol=True, as_object=True)
-            if dns_type == "A":
-                dns_records["A"].update({name.subdomain: dns_record})
-            elif dns_type == "AAAA":
-                dns_records["AAAA"].update({name.subdomain: dns_record})
+            if cur_page < dns_records_response['result_info']['total_pages']:
+                cur_page += 1
+            else:
+                break
 
-        return dns_records
+    def get_dns_records(self, zone_id, record_type=None, name=None):
+        """Get the DNS records of a zone, indexed by zone id, type and name
+
+        :param zone_id:
+        :param record_type: fetch only the records of this type
+        :param name: fetch only the records with this name
+        :return: the indexed DNS records or None when they can't be fetched
+        """
+        try:
+            return index_dns_records(self.iter_dns_records(zone_id, record_type=record_type, name=name))
+        except CloudflareAPIError as e:
+            log.error(e)
+            return None
 
     def update_record(self, subdomain, record_type='A', ip_address=None, ttl=settings.CF_DEFAULT_TTL,
                       proxied=settings.CF_PROXIED):
@@ -196,69 +567,143 @@ class Cloudflare(object):
         :return:
         """
 
-        record = {}
+        if not ip_address:
+            ip_address = get_external_ip(record_type)
+
+        if self.applied_state.is_applied(record_type, subdomain, ip_address):
+            log.info('⚌ DNS record %s already has the IP %s; taking no action', subdomain, ip_address)
+            metrics.records.inc(result='skipped')
+            return None
 
-        # Extract the domain
-        domain = tld.get_tld(subdomain, fix_protocol=True, as_object=True)
+        # the zones are listed only now, a record with the IP already applied never needs them
+        self.list_zones()
+        domain = parse_domain(subdomain, known_zones(self.account))
 
-        # get zones ID's
-        zones_ids = self.get_zones_ids(domain.fld)
-        zone_dns_records = self.get_dns_records(zones_ids[domain.fld])
+        # get zone ID
+        zone_id = self.get_zone_id(domain.fld)
+        if not zone_id:
+            log.error('∅ No zone found for %s', domain.fld)
+            metrics.records.inc(result='failed')
+            return None
 
-        if record_type == 'A':
-            # check if Cloudflare has any A records
-            dns_records = zone_dns_records.get('A')
-            if not dns_records:
-                log.error('∅ No A zone DNS records found for %s' % (domain.fld,))
-                return None
+        zone_dns_records = self.get_dns_records(zone_id, record_type=record_type, name=subdomain)
+        if zone_dns_records is None:
+            # the cached zone id may be stale, it will be fetched again on the next update
+            self.zone_cache.delete(zone_cache_key(self.account, domain.fld))
+            metrics.records.inc(result='failed')
+            return None
 
-            # check if the A zone dns records exist
-            record = dns_records.get(domain.subdomain)
-            if not record:
-                log.error('∅ No DNS A record found with this name: %s' % (subdomain,))
-                return None
+        return self.reconcile_record(zone_dns_records, domain.fld, zone_id, subdomain, record_type=record_type,
+                                     ip_address=ip_address, ttl=ttl, proxied=proxied)
 
-            # because if A records will query only IPv4 IP to find out the external IP
-            if not ip_address:
-                if settings.QUERY_CF_FOR_EXTERNAL_IP:
-                    ip_address = get_cf_ipv4()
-                else:
-                    ip_address = get_ipv4_address()
-        elif record_type == 'AAAA':
-            # check if Cloudflare has any A records
-            dns_records = zone_dns_records.get('AAAA')
-            if not dns_records:
-                log.error('∅ No AAAA zone DNS records found for %s' % (domain.fld,))
-                return None
+    def update_zone_records(self, zone, records, ip_addresses=None):
+        """Update all the configured DNS records of a zone against a single listing of the zone DNS records
 
-            # check if the A zone dns records exist
-            record = dns_records.get(domain.subdomain)
-            if not record:
-                log.error('∅ No DNS AAAA record found with this name: %s' % (subdomain,))
-                return None
+        :param zone: name of the zone, or domain name
+        :param records: Record of the plan that belong to the zone
+        :param ip_addresses: IP address already resolved for each record type
+        :return:
+        """
+        ip_addresses = ip_addresses or {}
+
+        records = pending_records(self.applied_state, records, ip_addresses)
+        if not records:
+            log.info('⚌ All DNS records of %s already have the external IP; taking no action', zone)
+            return None
 
-            # because if AAAA records will query only IPv4 IP to find out the external IP
-            if not ip_address:
-                ip_address = get_cf_ipv6()
+        zone_id = self.get_zone_id(zone)
+        if not zone_id:
+            log.error('∅ No zone found for %s', zone)
+            metrics.records.inc(len(records), result='failed')
+            return None
 
-        if record.get('content') == ip_address:
-            log.info('⚌ DNS record is already up-to-date; taking no action')
-            log.info("Date last modified: {}".format(record.get('modified_on')))
+        zone_dns_records = self.get_dns_records(zone_id, **dns_records_filters(records))
+        if zone_dns_records is None:
+            # the cached zone id may be stale, it will be fetched again on the next update
+            self.zone_cache.delete(zone_cache_key(self.account, zone))
+            metrics.records.inc(len(records), result='failed')
             return None
 
-        if record and ip_address:
-            log.info("📡 Updating DNS record %s" % record.get('name'))
+        updates = []
+        for x in records:
+            update = plan_update(self.applied_state, zone_dns_records, zone, zone_id, x.name, x.record_type,
+                                 record_ip_address(x, ip_addresses), x.ttl, x.proxied)
+            if update:
+                updates.append(update)
 
-            payload = {'type': record_type, 'name': subdomain, 'ttl': int(ttl), 'content': ip_address,
-                       'proxied': bool(proxied)}
+        if updates:
+            self.update_dns_records(zone_id, updates)
 
-            api_endpoint = getattr(settings, 'CLOUDFLARE_ZONE_DNS_RECORDS_UPDATE_API').format(
-                    zone_id=record['zone_id'], dns_record_id=record['id'])
+    def reconcile_record(self, zone_dns_records, zone, zone_id, subdomain, record_type='A', ip_address=None,
+                         ttl=settings.CF_DEFAULT_TTL, proxied=settings.CF_PROXIED):
+        """Compare a DNS record with the zone DNS records fetched from Cloudflare and update it if needed
 
-            update_record_response = self.query_api(api_endpoint, method='PUT', json_body=payload)
+        :param zone_dns_records: zone DNS records as returned by get_dns_records
+        :param zone: name of the zone
+        :param zone_id:
+        :param subdomain:
+        :param record_type: A or AAAA
+        :param ip_address:
+        :param ttl: Time to live for DNS record. Value of 1 is 'automatic'
+        :param proxied: Whether the record is receiving the performance and security benefits of Cloudflare
+        :return:
+        """
+        if not ip_address:
+            ip_address = get_external_ip(record_type)
 
-            if update_record_response:
-                log.info('😀 The DNS record for {} updated with new IP: {}'.format(subdomain, ip_address))
-            else:
-                log.error('❌ DNS record failed to update.')
-        return
+        update = plan_update(self.applied_state, zone_dns_records, zone, zone_id, subdomain, record_type,
+                             ip_address, ttl, proxied)
+        if update:
+            self.update_dns_record(*update)
+
+    def update_dns_record(self, record, payload):
+        """Update a single DNS record
+
+        :param record: the DNS record to update
+        :param payload: the new values of the record
+        :return:
+        """
+        log.info("📡 Updating DNS record %s", record.get('name'))
+
+        api_endpoint = getattr(settings, 'CLOUDFLARE_ZONE_DNS_RECORDS_UPDATE_API').format(
+                zone_id=record['zone_id'], dns_record_id=record['id'])
+
+        start = time.perf_counter()
+        update_record_response = self.query_api(api_endpoint, method='PATCH', json_body=payload)
+        record_updated(self.applied_state, record, payload,
+                       update_record_response and (update_record_response.get('result') or record),
+                       time.perf_counter() - start)
+
+    def update_dns_records(self, zone_id, updates):
+        """Update many DNS records of a zone with a single request to the batch endpoint
+
+        A batch is applied by Cloudflare all or nothing, so when it fails the records are
+        updated one by one and only the bad ones fail.
+
+        :param zone_id:
+        :param updates: list of (record, payload)
+        :return:
+        """
+        if len(updates) == 1 or not getattr(settings, 'CF_BATCH_UPDATES'):
+            for record, payload in updates:
+                self.update_dns_record(record, payload)
+            return
+
+        api_endpoint = batch_api(zone_id)
+
+        for batch in batches(updates, getattr(settings, 'CF_BATCH_SIZE')):
+            log.info("📡 Updating %d DNS records in a single batch", len(batch))
+
+            body = {'patches': [dict(payload, id=record['id']) for record, payload in batch]}
+            start = time.perf_counter()
+            batch_response = self.query_api(api_endpoint, method='POST', json_body=body)
+            duration = time.perf_counter() - start
+            if not batch_response:
+                log.warning("📡 Batch update failed, updating the DNS records one by one")
+                for record, payload in batch:
+                    self.update_dns_record(record, payload)
+                continue
+
+            results = {x.get('id'): x for x in (batch_response.get('result') or {}).get('patches') or []}
+            for record, payload in batch:
+                record_updated(self.applied_state, record, payload, results.get(record['id'], record), duration)
@@ -18,13 +18,23 @@
 import os
 
 from cloudflare_ddns.conf import settings
-from cloudflare_ddns.utils.log import configure_logging
 from cloudflare_ddns.utils import version
 from cloudflare_ddns.core.exceptions import WrongPyVersion
 
 os.environ.setdefault('CLOUDFLARE_SETTINGS_MODULE', 'cloudflare_ddns.settings')
-configure_logging(settings.LOGGING_CONFIG, settings.LOGGING)
 
 if not version.PY36:
     raise WrongPyVersion("🐍 This script requires Python 3.6+")
 
+
+def setup():
+    """Configure the logging from the settings, call it once before running the client
+
+    Importing the package has no side effects, so the settings are only read when needed.
+
+    :return:
+    """
+    from cloudflare_ddns.utils.log import configure_logging
+
+    configure_logging(settings.LOGGING_CONFIG, settings.LOGGING, settings.LOG_FORMAT, settings.LOG_QUEUE)
+
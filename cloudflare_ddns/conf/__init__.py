@@ -16,7 +16,9 @@
 #  along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import os
+import sys
 import importlib
+import threading
 
 from cloudflare_ddns.conf import global_settings
 from cloudflare_ddns.core.exceptions import ImproperlyConfigured
@@ -27,6 +29,10 @@ ENVIRONMENT_VARIABLE = "CLOUDFLARE_SETTINGS_MODULE"
 
 class LazySettings(LazyObject):
 
+    # held while a missing value is cached and while the settings are replaced, so a value
+    # read from the old settings is never cached after a reload
+    _lock = threading.RLock()
+
     def _setup(self, name=None):
         settings_module = os.environ.get(ENVIRONMENT_VARIABLE)
         if not settings_module:
@@ -49,24 +55,25 @@ class LazySettings(LazyObject):
 
     def __getattr__(self, name):
         """Return the value of a setting and cache it in self.__dict__."""
-        if self._wrapped is empty:
-            self._setup(name)
-
-        val = getattr(self._wrapped, name)
-
-        # Special case some settings which require further modification.
-        # This is done here for performance reasons so the modified value is cached.
-        # if name == 'CF_API_TOKEN' and not val:
-        #     raise ImproperlyConfigured("The CF_API_TOKEN setting must not be empty.")
-        #
-        # if name == 'CF_API_KEY' and not val:
-        #     raise ImproperlyConfigured("The CF_API_KEY setting must not be empty.")
-        #
-        # if name == 'CF_EMAIL' and val:
-        #     raise ImproperlyConfigured("The CF_EMAIL setting must not be empty.")
-
-        self.__dict__[name] = val
-        return val
+        with self._lock:
+            if self._wrapped is empty:
+                self._setup(name)
+
+            val = getattr(self._wrapped, name)
+
+            # Special case some settings which require further modification.
+            # This is done here for performance reasons so the modified value is cached.
+            # if name == 'CF_API_TOKEN' and not val:
+            #     raise ImproperlyConfigured("The CF_API_TOKEN setting must not be empty.")
+            #
+            # if name == 'CF_API_KEY' and not val:
+            #     raise ImproperlyConfigured("The CF_API_KEY setting must not be empty.")
+            #
+            # if name == 'CF_EMAIL' and val:
+            #     raise ImproperlyConfigured("The CF_EMAIL setting must not be empty.")
+
+            self.__dict__[name] = val
+            return val
 
     def __setattr__(self, name, value):
         """
@@ -84,6 +91,46 @@ class LazySettings(LazyObject):
         super().__delattr__(name)
         self.__dict__.pop(name, None)
 
+    def reload(self, check=None):
+        """Import the settings module again and replace all the settings at once
+
+        The cached values are dropped together with the old settings, so no value of the old
+        module is served after the reload. When the module can't be imported the error is raised
+        and the old settings are kept. The values set at runtime with setattr are lost.
+
+        :param check: called with the new settings in place, while the other threads wait for
+            them. When it raises, the old settings are put back and the error is raised
+        :return: the previous Settings
+        """
+        with self._lock:
+            if self._wrapped is empty:
+                self._setup()
+                return None
+
+            old = self._wrapped
+            settings_module = os.environ.get(ENVIRONMENT_VARIABLE) or old.SETTINGS_MODULE
+            if not settings_module:
+                raise ImproperlyConfigured("Settings set with settings.configure() can't be reloaded")
+            module = sys.modules.pop(settings_module, None)
+            try:
+                new = Settings(settings_module)
+            except BaseException:
+                if module is not None:
+                    sys.modules[settings_module] = module
+                raise
+            # a new dict replaces the cached values and _wrapped in a single step
+            previous = self.__dict__
+            object.__setattr__(self, '__dict__', {'_wrapped': new})
+            if check is not None:
+                try:
+                    check()
+                except BaseException:
+                    object.__setattr__(self, '__dict__', previous)
+                    if module is not None:
+                        sys.modules[settings_module] = module
+                    raise
+            return old
+
     def configure(self, default_settings=global_settings, **options):
         """
         Called to manually configure the settings. The 'default_settings'
@@ -17,4 +17,167 @@
 
 DEBUG = False
 
+# DNS records to keep updated, see the settings_example.py
+CF_SUBDOMAINS = []
 
+# TOML, YAML or JSON file with more DNS records, grouped by zone, see the records_example.toml
+CF_RECORDS_FILE = None
+
+# named Cloudflare credentials, the CF_SUBDOMAINS entries pick one with the 'account' key
+CF_ACCOUNTS = {}
+
+# DNS records requested for each page when the zone DNS records are listed, bigger pages need fewer requests
+CF_DNS_RECORDS_PER_PAGE = 5000
+
+# how many seconds a zone id is kept in the zone cache
+CF_ZONE_CACHE_TTL = 24 * 60 * 60
+
+# JSON file used to keep the zone cache between restarts, None keeps it only in memory
+CF_ZONE_CACHE_FILE = None
+
+# how many seconds a DNS record with the same external IP is trusted without querying Cloudflare,
+# after that the record is verified again to catch changes made outside of this script. 0 always verifies
+CF_FORCE_VERIFY_INTERVAL = 6 * 60 * 60
+
+# JSON file used to keep the last IP applied to each DNS record between restarts, None keeps it only in memory
+CF_STATE_FILE = None
+
+# update the DNS records of a zone with a single request to the batch endpoint, instead of one request each
+CF_BATCH_UPDATES = True
+
+# most DNS records sent in a single batch request
+CF_BATCH_SIZE = 200
+
+# public suffix list used to find the registered domain of the DNS records, None uses the one shipped with tld
+PSL_FILE = None
+
+# file used to keep the compiled public suffix list between restarts, None compiles it on every start
+PSL_CACHE_FILE = None
+
+#############################
+# Cloudflare API rate limit #
+#############################
+
+# requests allowed by Cloudflare in CF_RATE_LIMIT_PERIOD seconds for each user, shared by all the threads. 0 disables
+CF_RATE_LIMIT = 1200
+CF_RATE_LIMIT_PERIOD = 5 * 60
+
+# how many requests can be sent at once before being spread at the CF_RATE_LIMIT pace
+CF_RATE_LIMIT_BURST = 100
+
+# how many times a request rejected with 429 Too Many Requests is retried
+CF_MAX_RETRIES = 3
+
+# delay of the first retry when there is no Retry-After header, it doubles on each retry up to CF_RETRY_BACKOFF_MAX
+CF_RETRY_BACKOFF = 1
+CF_RETRY_BACKOFF_MAX = 60
+
+#############################
+# External IP query API's #
+#############################
+
+# how many seconds a detected external IP is reused before querying the API's again
+EXTERNAL_IP_CACHE_TTL = 5 * 60
+
+# how many of the EXTERNAL_IPV4_QUERY_APIS must report the same IPv4, they are all queried in parallel
+EXTERNAL_IPV4_QUORUM = 1
+
+# seconds to wait for the external IP services
+EXTERNAL_IP_QUERY_TIMEOUT = 10
+
+# seconds without an answer before the next best ranked external IP service is queried too
+EXTERNAL_IP_HEDGE_DELAY = 1.0
+
+# weight of the last query in the moving average of the latency and failure rate of each service
+EXTERNAL_IP_STATS_ALPHA = 0.3
+
+# consecutive failures after which an external IP service is skipped for EXTERNAL_IP_CIRCUIT_COOLDOWN seconds
+EXTERNAL_IP_FAILURE_THRESHOLD = 3
+EXTERNAL_IP_CIRCUIT_COOLDOWN = 10 * 60
+
+# where the IPv6 address for the AAAA records comes from: 'cloudflare' queries EXTERNAL_CF_IPV6_QUERY_API,
+# 'interface' reads the global address configured on the host, without any network probe
+IPV6_SOURCE = 'cloudflare'
+
+# with IPV6_SOURCE = 'interface', use only the addresses of this interface, None uses all the interfaces
+IPV6_INTERFACE = None
+
+# with IPV6_SOURCE = 'interface', use only the addresses inside these networks, e.g. ['2001:db8::/32']
+IPV6_PREFIXES = []
+
+#############################
+# IP address changes        #
+#############################
+
+# listen for the kernel IP address changes (Linux rtnetlink) and update the DNS records right away
+NETLINK_MONITOR = False
+
+# seconds to wait after the last IP address change of a burst before the DNS records are updated
+NETLINK_DEBOUNCE = 5
+
+# seconds between polling sweeps while the netlink listener runs, None keeps SCHEDULE_DELAY_TASKS.
+# Behind NAT the external IP may change without any local address change, so keep polling as fallback
+NETLINK_POLL_DELAY = None
+
+#############################
+# HTTP connections          #
+#############################
+
+# number of hosts that keep a pool of keep-alive connections
+HTTP_POOL_CONNECTIONS = 10
+
+# maximum number of keep-alive connections for each host
+HTTP_POOL_MAXSIZE = 10
+
+# how many times a failed connection or a 5xx response is retried, a read timeout is never retried.
+# A request then takes at most (HTTP_MAX_RETRIES + 1) connect timeouts and a read timeout, plus the backoff delays
+HTTP_MAX_RETRIES = 3
+
+# factor of the exponential delay between retries: {backoff factor} * (2 ** ({retry number} - 1))
+HTTP_RETRY_BACKOFF_FACTOR = 0.5
+
+#############################
+# Metrics                   #
+#############################
+
+# port of the Prometheus /metrics endpoint, None disables it
+METRICS_PORT = None
+
+# interface the metrics endpoint listens on, 0.0.0.0 exposes it to the network
+METRICS_ADDRESS = '127.0.0.1'
+
+#############################
+# Logging                   #
+#############################
+
+# 'text' writes the log messages as they are, 'json' writes one JSON object per line with the structured fields
+# of the message, like the record, zone, old_ip and new_ip of a DNS record update
+LOG_FORMAT = 'text'
+
+# write the log messages from a background thread, the threads that update the DNS records only queue them
+LOG_QUEUE = False
+
+#############################
+# Global settings           #
+#############################
+
+# how many seconds each task will be delayed from the next task
+SCHEDULE_DELAY_TASKS = 30 * 60
+
+# 'sweep' reconciles all the enabled DNS records on every task, 'record' checks only one DNS record per task
+SCHEDULE_MODE = 'sweep'
+
+# maximum random delay, in seconds, added before each zone job of a sweep to spread the API calls
+SCHEDULE_RECORD_JITTER = 0
+
+# maximum number of zone jobs of a sweep that run at the same time
+SCHEDULE_MAX_WORKERS = 4
+
+# 'schedule' runs the sweeps with the schedule loop, 'asyncio' runs them with the asyncio engine (requires aiohttp)
+SCHEDULE_ENGINE = 'schedule'
+
+# maximum number of concurrent HTTP requests of the asyncio engine
+ASYNC_CONCURRENCY = 10
+
+# reload the settings when the settings file changes, like on SIGHUP (systemctl reload cfddns)
+SETTINGS_WATCH = False
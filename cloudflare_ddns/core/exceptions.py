@@ -34,6 +34,11 @@ class ImproperlyConfigured(Exception):
     pass
 
 
+class CloudflareAPIError(Exception):
+    """A request to the Cloudflare API failed"""
+    pass
+
+
 class ValidationError(Exception):
     """An error while validating data.
 
@@ -0,0 +1,134 @@
+#  -*- coding: utf-8 -*-
+#
+#              Copyright (C) 2018-2021 ProGeek
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import json
+import time
+import atexit
+import logging
+import threading
+
+log = logging.getLogger('cf_logging')
+
+
+class TTLCache:
+    """Thread safe key/value cache where every entry expires after `ttl` seconds.
+
+    When a `path` is given, the entries are also saved on disk as JSON, so they
+    survive a restart of the script. The file is read on first access, and written
+    by flush() only when the entries changed, flush() runs at exit too.
+    """
+
+    def __init__(self, ttl, path=None):
+        self.ttl = ttl
+        self.path = path
+        self._entries = {}
+        self._loaded = False
+        self._dirty = False
+        self._lock = threading.RLock()
+        if path:
+            atexit.register(self.flush)
+
+    def get(self, key, default=None):
+        with self._lock:
+            self._load()
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            value, expires_at = entry
+            if expires_at is not None and expires_at < time.time():
+                del self._entries[key]
+                return default
+            return value
+
+    def set(self, key, value):
+        self.update({key: value})
+
+    def update(self, items):
+        expires_at = time.time() + self.ttl if self.ttl else None
+        with self._lock:
+            self._load()
+            for key, value in items.items():
+                self._entries[key] = (value, expires_at)
+            self._dirty = True
+
+    def delete(self, key):
+        with self._lock:
+            self._load()
+            if self._entries.pop(key, None) is not None:
+                self._dirty = True
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._loaded = True
+            self._dirty = True
+
+    def keys(self):
+        """The keys of the entries that are not expired
+
+        :return:
+        """
+        now = time.time()
+        with self._lock:
+            self._load()
+            return [key for key, (_, expires_at) in self._entries.items() if expires_at is None or expires_at >= now]
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def _load(self):
+        if self._loaded:
+            return
+        self._loaded = True
+
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r') as fp:
+                data = json.load(fp)
+        except (OSError, ValueError) as e:
+            log.warning("🗃 Cache file %s can't be read: %s", self.path, e)
+            return
+
+        now = time.time()
+        for key, (value, expires_at) in data.items():
+            if expires_at is None or expires_at >= now:
+                self._entries[key] = (value, expires_at)
+
+    def flush(self):
+        """Write the entries to the file, if they changed since the last write
+
+        A sweep changes many entries, the file is written once at its end instead of after each of them.
+
+        :return:
+        """
+        with self._lock:
+            if not self.path or not self._dirty:
+                return
+            try:
+                directory = os.path.dirname(self.path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                # write a temporary file and swap it, so a crash never leaves a truncated cache
+                tmp_path = self.path + '.tmp'
+                with open(tmp_path, 'w') as fp:
+                    json.dump(self._entries, fp)
+                os.replace(tmp_path, self.path)
+                self._dirty = False
+            except OSError as e:
+                log.warning("🗃 Cache file %s can't be written: %s", self.path, e)
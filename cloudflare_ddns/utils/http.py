@@ -0,0 +1,99 @@
+#  -*- coding: utf-8 -*-
+#
+#              Copyright (C) 2018-2021 ProGeek
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import threading
+
+from cloudflare_ddns.conf import settings
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def build_session(pool_connections=None, pool_maxsize=None, max_retries=None, backoff_factor=None):
+    """Build a keep-alive HTTP session with a connection pool and a retry policy
+
+    Only the failed connections and the 5xx responses are retried. A read timeout is not: the
+    request may have reached Cloudflare, and it already waited the whole timeout. So a request
+    takes at most (max_retries + 1) connect timeouts and a read timeout, plus the backoff delays.
+
+    :param pool_connections: number of hosts that keep a connection pool
+    :param pool_maxsize: maximum number of connections kept alive for each host
+    :param max_retries: how many times a failed connection or a 5xx response is retried
+    :param backoff_factor: factor of the exponential delay between retries
+    :return:
+    """
+    # requests is the slowest import of the script, it's loaded only when the first session is built
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    if pool_connections is None:
+        pool_connections = settings.HTTP_POOL_CONNECTIONS
+    if pool_maxsize is None:
+        pool_maxsize = settings.HTTP_POOL_MAXSIZE
+    if max_retries is None:
+        max_retries = settings.HTTP_MAX_RETRIES
+    if backoff_factor is None:
+        backoff_factor = settings.HTTP_RETRY_BACKOFF_FACTOR
+
+    retry = Retry(
+        total=max_retries,
+        connect=max_retries,
+        read=0,
+        status=max_retries,
+        backoff_factor=backoff_factor,
+        status_forcelist=(500, 502, 503, 504),
+        raise_on_status=False,
+        # 429 Too Many Requests is retried by the Cloudflare client, so the shared rate limiter knows about it
+        respect_retry_after_header=False
+    )
+    adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, max_retries=retry)
+
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def get_session(name='default', **options):
+    """A named HTTP session shared by the whole script
+
+    The connections are kept alive and reused, so only the first request to a host
+    pays for the TCP and TLS handshake. The sessions are safe to use from many threads.
+
+    :param name: the Cloudflare client uses 'default', the external IP probes use their own session
+    :param options: build_session arguments, used only when the session is created
+    :return:
+    """
+    session = _sessions.get(name)
+    if session is None:
+        with _sessions_lock:
+            session = _sessions.get(name)
+            if session is None:
+                session = _sessions[name] = build_session(**options)
+    return session
+
+
+def close_sessions():
+    """Close the shared HTTP sessions and all the pooled connections
+
+    :return:
+    """
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
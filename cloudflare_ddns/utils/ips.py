@@ -15,16 +15,45 @@
 #  You should have received a copy of the GNU General Public License
 #  along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import time
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
 import ipaddress
-import requests
 
 from cloudflare_ddns.conf import settings
 from cloudflare_ddns.core.exceptions import ValidationError
+from cloudflare_ddns.utils.http import get_session
+from cloudflare_ddns.utils.providers import ProviderRegistry, Hedge
+from cloudflare_ddns.utils import metrics
 
 log = logging.getLogger('cf_logging')
 
+# external IP addresses already resolved, by DNS record type: {record_type: (ip_address, resolved_at)}
+_ip_cache = {}
+_ip_cache_lock = threading.Lock()
+
+# threads of the external IPv4 queries, created on the first lookup and reused by the next ones
+_executor = None
+_executor_lock = threading.Lock()
+
+# latency and health of the external IP services
+provider_stats = ProviderRegistry(alpha=settings.EXTERNAL_IP_STATS_ALPHA,
+                                  failure_threshold=settings.EXTERNAL_IP_FAILURE_THRESHOLD,
+                                  cooldown=settings.EXTERNAL_IP_CIRCUIT_COOLDOWN)
+
+# IPv6 addresses configured on the host, as reported by the kernel
+IF_INET6_PATH = '/proc/net/if_inet6'
+
+# address scope and flags from linux/if_addr.h
+IPV6_ADDR_SCOPE_GLOBAL = 0x00
+IFA_F_TEMPORARY = 0x01
+IFA_F_DADFAILED = 0x08
+IFA_F_DEPRECATED = 0x20
+IFA_F_TENTATIVE = 0x40
+IFA_F_PERMANENT = 0x80
+
 
 def clean_ipv6_address(ip_str, unpack_ipv4=False,
                        error_message="This is not a valid IPv6 address."):
@@ -64,20 +93,80 @@ def is_valid_ipv6_address(ip_str):
     return True
 
 
+def clean_public_ip(text, version=4):
+    """Validate the answer of an external IP service
+
+    :param text: body returned by the service
+    :param version: 4 or 6, the IP version expected
+    :return: the IP address in canonical form, None if it isn't a public address of this version
+    """
+    try:
+        address = ipaddress.ip_address(text.strip())
+    except ValueError:
+        return None
+    if address.version != version or not address.is_global:
+        return None
+    return str(address)
+
+
+def parse_cf_trace(text):
+    """Extract the IP address from the body returned by the Cloudflare trace service
+
+    :param text: lines with key=value pairs
+    :return:
+    """
+    trace = dict(line.split("=", 1) for line in text.splitlines() if "=" in line)
+    return trace.get('ip')
+
+
+def probe(api, version=4, parse=None, timeout=10):
+    """Ask an external service for the IP address and record its latency and health in provider_stats
+
+    :param api: URL of the service
+    :param version: 4 or 6, the IP version expected
+    :param parse: function that extracts the IP from the body, the whole body is the IP by default
+    :param timeout:
+    :return: the public IP address, None if the answer isn't one
+    :raise requests.exceptions.RequestException: when the service is not reachable
+    """
+    from requests.exceptions import RequestException
+
+    start = time.monotonic()
+    try:
+        # no retries, a failing service is routed around by get_ipv4_address instead
+        r = get_session('ip_probes', max_retries=0).get(api, timeout=timeout)
+        r.raise_for_status()
+    except RequestException:
+        provider_stats.record_failure(api, time.monotonic() - start)
+        metrics.ip_probe_latency.observe(time.monotonic() - start, provider=api, result='error')
+        raise
+
+    ip_address = clean_public_ip((parse(r.text) if parse else r.text) or '', version=version)
+    latency = time.monotonic() - start
+    if ip_address:
+        provider_stats.record_success(api, latency)
+    else:
+        provider_stats.record_failure(api, latency)
+    metrics.ip_probe_latency.observe(latency, provider=api, result='success' if ip_address else 'failure')
+    return ip_address
+
+
 def get_cf_ipv4():
     """Get from Cloudflare service the IPv4 address of local host
 
     :return:
     """
+    from requests.exceptions import RequestException
+
     a = None
 
     try:
-        log.info("Fetching IPv4 IP from: {}".format(settings.EXTERNAL_CF_IPV4_QUERY_API))
-        a = requests.get(settings.EXTERNAL_CF_IPV4_QUERY_API, timeout=10).text.split("\n")
-        a.pop()
-        a = dict(s.split("=") for s in a)['ip']  # noqa
-    except requests.exceptions.RequestException as e:
-        pass
+        log.info("Fetching IPv4 IP from: %s", settings.EXTERNAL_CF_IPV4_QUERY_API)
+        a = probe(settings.EXTERNAL_CF_IPV4_QUERY_API, version=4, parse=parse_cf_trace)
+    except RequestException as e:
+        log.debug("Cloudflare IPv4 service %s not reachable: %s", settings.EXTERNAL_CF_IPV4_QUERY_API, e)
+
+    if not a:
         log.error("🧩 Cloudflare IPv4 not detected")
 
     return a
@@ -88,31 +177,243 @@ def get_cf_ipv6():
 
     :return:
     """
+    from requests.exceptions import RequestException
+
     aaaa = None  # noqa
 
     try:
-        log.info("Fetching IPv6 IP from: {}".format(settings.EXTERNAL_CF_IPV6_QUERY_API))
-        aaaa = requests.get(settings.EXTERNAL_CF_IPV6_QUERY_API, timeout=10).text.split("\n")
-        aaaa.pop()
-        aaaa = dict(s.split("=") for s in aaaa)['ip']  # noqa
-    except requests.exceptions.RequestException as e:
+        log.info("Fetching IPv6 IP from: %s", settings.EXTERNAL_CF_IPV6_QUERY_API)
+        aaaa = probe(settings.EXTERNAL_CF_IPV6_QUERY_API, version=6, parse=parse_cf_trace)
+    except RequestException as e:
+        log.debug("Cloudflare IPv6 service %s not reachable: %s", settings.EXTERNAL_CF_IPV6_QUERY_API, e)
+
+    if not aaaa:
         log.error("🧩 Cloudflare IPv6 not detected")
 
     return aaaa
 
 
-def get_ipv4_address():
+def get_local_ipv6(interface=None, prefixes=None, path=IF_INET6_PATH):
+    """Get the global IPv6 address configured on a local interface, without any network probe
+
+    The stable addresses are preferred over the temporary (privacy) ones, and the
+    static addresses over the autoconfigured ones. Deprecated, tentative and
+    duplicated addresses are never used.
+
+    :param interface: use only the addresses of this interface, e.g. eth0
+    :param prefixes: use only the addresses inside these networks, e.g. ['2001:db8::/32']
+    :param path: file with the addresses in the /proc/net/if_inet6 format
+    :return:
     """
+    networks = [ipaddress.IPv6Network(x, strict=False) for x in prefixes or []]
+
+    try:
+        with open(path, 'r') as fp:
+            lines = fp.readlines()
+    except OSError as e:
+        log.error("🧩 Local IPv6 addresses can't be read from %s: %s", path, e)
+        return None
+
+    candidates = []
+    for line in lines:
+        fields = line.split()
+        if len(fields) < 6:
+            continue
+
+        address, _, _, scope, flags, name = fields[:6]
+        scope, flags = int(scope, 16), int(flags, 16)
+        if scope != IPV6_ADDR_SCOPE_GLOBAL or flags & (IFA_F_DADFAILED | IFA_F_DEPRECATED | IFA_F_TENTATIVE):
+            continue
+        if interface and name != interface:
+            continue
+
+        address = ipaddress.IPv6Address(bytes.fromhex(address))
+        if networks:
+            if not any(address in network for network in networks):
+                continue
+        elif not address.is_global:
+            continue
+
+        candidates.append((bool(flags & IFA_F_TEMPORARY), not flags & IFA_F_PERMANENT, str(address)))
+
+    if not candidates:
+        log.error("🧩 No global IPv6 address found on %s", interface or 'the local interfaces')
+        return None
+
+    return min(candidates)[2]
+
+
+def get_executor():
+    """The thread pool of the external IPv4 queries, shared by all the lookups
+
+    A query abandoned by a lookup keeps its thread until its timeout, so there are twice
+    as many threads as services.
 
     :return:
     """
+    global _executor
 
-    for api in settings.EXTERNAL_IPV4_QUERY_APIS:
-        try:
-            log.info("Fetching {}".format(api))
-            r = requests.get(api, timeout=10)
-            return r.text.strip()  # Fix bug with trailing whitespace
-        except requests.exceptions.RequestException as e:
-            log.error('Cannot fetch your external ip. {} not reachable.'.format(api))
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=max(4, 2 * len(settings.EXTERNAL_IPV4_QUERY_APIS)),
+                                           thread_name_prefix='ipv4_query')
+        return _executor
+
+
+def shutdown_executor():
+    """Stop the threads of the external IPv4 queries, the next lookup starts new ones
+
+    :return:
+    """
+    global _executor
 
+    with _executor_lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=False)
+
+
+def get_ipv4_address(quorum=None, timeout=None):
+    """Query the EXTERNAL_IPV4_QUERY_APIS and return the first IP reported by `quorum` of them
+
+    The services are ranked by their latency and failure rate, see provider_stats. The
+    best `quorum` services are queried first, and the next one is added every
+    EXTERNAL_IP_HEDGE_DELAY seconds without an answer, or as soon as one fails. So a
+    slow service doesn't delay the answer, and a single misbehaving service can't
+    publish a wrong IP when the quorum is bigger than 1.
+
+    :param quorum: how many services must report the same IP, default EXTERNAL_IPV4_QUORUM
+    :param timeout: seconds to wait for the services, default EXTERNAL_IP_QUERY_TIMEOUT
+    :return:
+    """
+    from requests.exceptions import RequestException
+
+    hedge = Hedge(provider_stats.rank(settings.EXTERNAL_IPV4_QUERY_APIS), quorum or settings.EXTERNAL_IPV4_QUORUM)
+    if not hedge.count:
+        return None
+
+    timeout = timeout or settings.EXTERNAL_IP_QUERY_TIMEOUT
+    deadline = time.monotonic() + timeout
+
+    executor = get_executor()
+    futures = {}
+
+    def query(apis):
+        for api in apis:
+            log.info("Fetching %s", api)
+            futures[executor.submit(probe, api, 4, None, timeout)] = api
+
+    query(hedge.first())
+
+    try:
+        pending = set(futures)
+        while pending:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                log.error('External IPv4 services did not answer in %s seconds', timeout)
+                break
+
+            done, pending = wait(pending, timeout=min(settings.EXTERNAL_IP_HEDGE_DELAY, remaining),
+                                 return_when=FIRST_COMPLETED)
+            failed = 0
+            for future in done:
+                api = futures[future]
+                try:
+                    ip_address = future.result()
+                except RequestException:
+                    log.error('Cannot fetch your external ip. %s not reachable.', api)
+                    ip_address = None
+                else:
+                    if not ip_address:
+                        log.error('%s did not answer with a public IPv4 address', api)
+
+                if hedge.answered(ip_address):
+                    log.info("External IPv4 %s confirmed by %d of %d services", ip_address, hedge.quorum,
+                             hedge.count)
+                    return ip_address
+                failed += not ip_address
+
+            # hedge: replace the failed services, and query one more when nothing answered in time
+            query(hedge.next(failed, not done))
+            pending = {x for x in futures if not x.done()}
+    finally:
+        # the queries still running are abandoned, their answer is not needed anymore
+        for future in futures:
+            future.cancel()
+
+    log.error('🧩 No external IPv4 reported by %d services: %s', hedge.quorum, dict(hedge.votes))
     return None
+
+
+def get_external_ip(record_type='A'):
+    """Get the external IP address used for a DNS record type
+
+    The address is cached for EXTERNAL_IP_CACHE_TTL seconds, so all the DNS records
+    checked during a sweep share the same probe.
+
+    :param record_type: A for the IPv4 address or AAAA for the IPv6 address
+    :return:
+    """
+    ip_address = get_cached_ip(record_type)
+    if ip_address:
+        return ip_address
+
+    if record_type == 'A':
+        ip_address = None
+        if settings.QUERY_CF_FOR_EXTERNAL_IP and provider_stats.is_available(settings.EXTERNAL_CF_IPV4_QUERY_API):
+            ip_address = get_cf_ipv4()
+        if not ip_address:
+            ip_address = get_ipv4_address()
+    elif record_type == 'AAAA':
+        if settings.IPV6_SOURCE == 'interface':
+            ip_address = get_local_ipv6(settings.IPV6_INTERFACE, settings.IPV6_PREFIXES)
+        else:
+            ip_address = get_cf_ipv6()
+    else:
+        return None
+
+    if ip_address:
+        cache_ip(record_type, ip_address)
+    return ip_address
+
+
+def get_cached_ip(record_type):
+    """The external IP address resolved for a DNS record type, if is not older than EXTERNAL_IP_CACHE_TTL
+
+    :param record_type: A or AAAA
+    :return:
+    """
+    with _ip_cache_lock:
+        cached = _ip_cache.get(record_type)
+    if cached and time.monotonic() - cached[1] < settings.EXTERNAL_IP_CACHE_TTL:
+        return cached[0]
+    return None
+
+
+def cache_ip(record_type, ip_address):
+    """Remember the external IP address resolved for a DNS record type
+
+    :param record_type: A or AAAA
+    :param ip_address:
+    :return:
+    """
+    with _ip_cache_lock:
+        _ip_cache[record_type] = (ip_address, time.monotonic())
+
+
+def resolve_external_ips(record_types=('A', 'AAAA')):
+    """Resolve the external IP address once for each DNS record type of a sweep
+
+    :param record_types: DNS record types that will be updated
+    :return: dict with the IP address for every record type, None if it can't be detected
+    """
+    return {record_type: get_external_ip(record_type) for record_type in set(record_types)}
+
+
+def clear_ip_cache():
+    """Forget the resolved external IP addresses, the next call will probe again
+
+    :return:
+    """
+    with _ip_cache_lock:
+        _ip_cache.clear()
@@ -16,9 +16,13 @@
 #  along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import os
+import json
+import queue
+import atexit
 from pathlib import Path
 import logging
 import logging.config
+import logging.handlers
 
 from cloudflare_ddns.conf import settings
 from cloudflare_ddns.utils.utils import import_string
@@ -48,6 +52,9 @@ DEFAULT_LOGGING = {
             'format': '{levelname} {message}',
             'style': '{',
         },
+        'json': {
+            '()': 'cloudflare_ddns.utils.log.JsonFormatter',
+        },
     },
     'handlers': {
         'file': {
@@ -56,6 +63,8 @@ DEFAULT_LOGGING = {
             'maxBytes': 5 * 1024 * 1024,
             'backupCount': 3,
             'filename': 'log/debug.log',
+            # the file is opened on the first DEBUG record, not when the logging is configured
+            'delay': True,
             'formatter': 'verbose',
             'filters': ['require_debug_true']
         },
@@ -86,17 +95,79 @@ DEFAULT_LOGGING = {
 }
 
 
-def configure_logging(logging_config, logging_settings):
+# the loggers whose handlers are moved behind a queue by LOG_QUEUE
+QUEUED_LOGGERS = ('cf_logging', 'file', 'schedule')
+
+_listeners = []
+
+
+def configure_logging(logging_config, logging_settings, log_format='text', log_queue=False):
+    """
+    :param logging_config: the callable to use to configure logging
+    :param logging_settings: custom logging configuration, applied over DEFAULT_LOGGING
+    :param log_format: 'text' or 'json', the formatter of the default handlers
+    :param log_queue: write the log records from a background thread
+    :return:
+    """
     if logging_config:
         # First find the logging configuration function ...
         logging_config_func = import_string(logging_config)
 
-        logging.config.dictConfig(DEFAULT_LOGGING)
+        # the listeners of a previous configuration write to handlers that are about to be closed
+        stop_queue_logging()
+
+        default_logging = DEFAULT_LOGGING
+        if log_format == 'json':
+            default_logging = dict(DEFAULT_LOGGING, handlers={
+                name: dict(handler, formatter='json') for name, handler in DEFAULT_LOGGING['handlers'].items()})
+        logging.config.dictConfig(default_logging)
 
         # ... then invoke it with the logging settings
         if logging_settings:
             logging_config_func(logging_settings)
 
+        if log_queue:
+            start_queue_logging(QUEUED_LOGGERS)
+
+
+def start_queue_logging(logger_names):
+    """Move the handlers of the loggers to background threads, the loggers only put the records in a queue
+
+    The records are formatted and written by a QueueListener, so the slow console and file I/O
+    doesn't delay the threads that update the DNS records. Loggers that share the same handlers
+    share the same listener.
+
+    :param logger_names:
+    :return:
+    """
+    queue_handlers = {}
+    for name in logger_names:
+        logger = logging.getLogger(name)
+        handlers = tuple(logger.handlers)
+        if not handlers or any(isinstance(x, logging.handlers.QueueHandler) for x in handlers):
+            continue
+
+        if handlers not in queue_handlers:
+            records = queue.Queue(-1)
+            listener = logging.handlers.QueueListener(records, *handlers, respect_handler_level=True)
+            listener.start()
+            _listeners.append(listener)
+            queue_handlers[handlers] = logging.handlers.QueueHandler(records)
+
+        logger.handlers = [queue_handlers[handlers]]
+
+    if queue_handlers:
+        atexit.register(stop_queue_logging)
+
+
+def stop_queue_logging():
+    """Write the records still in the queues and stop the listeners
+
+    :return:
+    """
+    while _listeners:
+        _listeners.pop().stop()
+
 
 class RequireDebugFalse(logging.Filter):
 
@@ -125,3 +196,29 @@ class ServerFormatter(logging.Formatter):
 
     def uses_server_time(self):
         return self._fmt.find('{server_time}') >= 0
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, with the fields passed in `extra` next to the message
+
+        log.info("Updated %s", name, extra={'record': name, 'old_ip': old, 'new_ip': new})
+    """
+
+    # attributes of every LogRecord, anything else was passed in `extra`
+    reserved = frozenset(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record, self.datefmt),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        entry.update((key, value) for key, value in vars(record).items() if key not in self.reserved)
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exception'] = record.exc_text
+        if record.stack_info:
+            entry['stack'] = self.formatStack(record.stack_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
@@ -0,0 +1,194 @@
+#  -*- coding: utf-8 -*-
+#
+#              Copyright (C) 2018-2021 ProGeek
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import bisect
+import logging
+import threading
+from urllib.parse import urlsplit
+
+log = logging.getLogger('cf_logging')
+
+# every metric created by counter() and histogram(), in the order they are shown
+_registry = []
+
+DEFAULT_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+
+
+def escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def format_labels(names, values, extra=''):
+    pairs = ['%s="%s"' % (name, escape(value)) for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{%s}' % ','.join(pairs) if pairs else ''
+
+
+class Metric(object):
+    """A metric in the Prometheus text format, with one value for each combination of labels
+
+    The subclasses define samples(), the (name, labels, value) lines rendered for the metric.
+    """
+
+    kind = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(labels.get(x, '') for x in self.labels)
+
+    def render(self):
+        lines = ['# HELP %s %s' % (self.name, self.documentation), '# TYPE %s %s' % (self.name, self.kind)]
+        lines.extend('%s%s %s' % (name, labels, repr(float(value))) for name, labels, value in self.samples())
+        return '\n'.join(lines)
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            yield self.name + '_total', format_labels(self.labels, key), value
+
+
+class Histogram(Metric):
+    """Count the observed values in cumulative buckets, plus their sum and count"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                # one count for each bucket, plus +Inf, the sum
+                counts = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            counts[-1] += value
+
+    def samples(self):
+        with self._lock:
+            values = sorted((key, list(counts)) for key, counts in self._values.items())
+        for key, counts in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(float(bound))
+                yield self.name + '_bucket', format_labels(self.labels, key, 'le="%s"' % le), cumulative
+            yield self.name + '_sum', format_labels(self.labels, key), counts[-1]
+            yield self.name + '_count', format_labels(self.labels, key), cumulative
+
+
+def counter(name, documentation, labels=()):
+    metric = Counter(name, documentation, labels)
+    _registry.append(metric)
+    return metric
+
+
+def histogram(name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+    metric = Histogram(name, documentation, labels, buckets)
+    _registry.append(metric)
+    return metric
+
+
+def render_metrics():
+    """All the metrics in the Prometheus text exposition format
+
+    :return:
+    """
+    return '\n'.join(x.render() for x in _registry) + '\n'
+
+
+def endpoint_label(url):
+    """Path of a Cloudflare API URL with the ids replaced, so each endpoint is a single label value
+
+    :param url: like https://api.cloudflare.com/client/v4/zones/023e1/dns_records/372e6
+    :return: like /client/v4/zones/{id}/dns_records/{id}
+    """
+    segments = urlsplit(url).path.split('/')
+    for i in range(1, len(segments)):
+        if segments[i - 1] in ('zones', 'dns_records') and segments[i] not in ('', 'batch'):
+            segments[i] = '{id}'
+    return '/'.join(segments)
+
+
+api_latency = histogram('cfddns_api_request_duration_seconds', 'Latency of the Cloudflare API requests',
+                        ('method', 'endpoint'))
+api_responses = counter('cfddns_api_responses', 'Cloudflare API responses by HTTP status', ('method', 'status'))
+api_rate_limited = counter('cfddns_api_rate_limited', 'Cloudflare API requests rejected with 429 Too Many Requests')
+ip_probe_latency = histogram('cfddns_ip_probe_duration_seconds', 'Latency of the external IP services',
+                             ('provider', 'result'))
+sweep_duration = histogram('cfddns_sweep_duration_seconds', 'Duration of a sweep of all the DNS records',
+                           buckets=(.1, .25, .5, 1, 2.5, 5, 10, 30, 60, 120, 300))
+records = counter('cfddns_records', 'DNS records checked against Cloudflare, updated, skipped or failed', ('result',))
+jobs_failed = counter('cfddns_jobs_failed', 'Sweep jobs stopped by an exception')
+
+
+def start_metrics_server(address, port):
+    """Serve the metrics on http://address:port/metrics from a daemon thread
+
+    :param address: interface to listen on, 127.0.0.1 keeps the metrics local
+    :param port:
+    :return: the running server
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            if self.path.split('?', 1)[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = render_metrics().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((address, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='cf_metrics', daemon=True).start()
+    log.info("📊 Metrics available on http://%s:%d/metrics", address, server.server_address[1])
+    return server
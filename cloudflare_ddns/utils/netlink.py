@@ -0,0 +1,160 @@
+#  -*- coding: utf-8 -*-
+#
+#              Copyright (C) 2018-2021 ProGeek
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import sys
+import errno
+import select
+import socket
+import struct
+import logging
+import threading
+
+log = logging.getLogger('cf_logging')
+
+# multicast groups and message types from linux/rtnetlink.h
+RTMGRP_IPV4_IFADDR = 0x10
+RTMGRP_IPV6_IFADDR = 0x100
+RTM_NEWADDR = 20
+RTM_DELADDR = 21
+RT_SCOPE_UNIVERSE = 0
+
+# seconds before the socket is opened again after an error, doubled after each failure up to the maximum
+REOPEN_DELAY = 1
+REOPEN_MAX_DELAY = 300
+
+# struct nlmsghdr followed by struct ifaddrmsg
+NLMSG_HEADER = struct.Struct('=IHHII')
+IFADDR_MESSAGE = struct.Struct('=BBBBI')
+
+
+def is_supported():
+    """Whether the kernel can notify the IP address changes over rtnetlink
+
+    :return:
+    """
+    return sys.platform.startswith('linux') and hasattr(socket, 'AF_NETLINK')
+
+
+def address_changes(data):
+    """Parse the rtnetlink messages and return the changes of global IP addresses
+
+    :param data: bytes received from the netlink socket
+    :return: list of (message type, address family, interface index)
+    """
+    changes = []
+    offset = 0
+    while offset + NLMSG_HEADER.size <= len(data):
+        length, msg_type, flags, seq, pid = NLMSG_HEADER.unpack_from(data, offset)
+        if length < NLMSG_HEADER.size:
+            break
+
+        if msg_type in (RTM_NEWADDR, RTM_DELADDR) and length >= NLMSG_HEADER.size + IFADDR_MESSAGE.size:
+            family, prefix_len, ifa_flags, scope, index = IFADDR_MESSAGE.unpack_from(data, offset + NLMSG_HEADER.size)
+            # link local and host addresses never show up as the external IP
+            if scope == RT_SCOPE_UNIVERSE:
+                changes.append((msg_type, family, index))
+
+        # messages are aligned to 4 bytes
+        offset += (length + 3) & ~3
+    return changes
+
+
+class AddressMonitor(threading.Thread):
+    """Listen for RTM_NEWADDR and RTM_DELADDR kernel events and call `callback`
+
+    The events come in bursts when an interface goes up or down, so the callback runs
+    once, `debounce` seconds after the last event of a burst. When the kernel drops events
+    because the socket buffer is full, the callback runs too. On the other errors the socket
+    is opened again, so the listener never stops before stop() is called.
+    """
+
+    def __init__(self, callback, debounce=5):
+        super().__init__(name='netlink', daemon=True)
+        self.callback = callback
+        self.debounce = debounce
+        self._stop_event = threading.Event()
+        self._timer = None
+        self._timer_lock = threading.Lock()
+        self._sock = self._open()
+
+    @staticmethod
+    def _open():
+        sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, socket.NETLINK_ROUTE)
+        try:
+            sock.bind((0, RTMGRP_IPV4_IFADDR | RTMGRP_IPV6_IFADDR))
+        except OSError:
+            sock.close()
+            raise
+        return sock
+
+    def _close(self):
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+    def run(self):
+        log.info("👂 Listening for IP address changes")
+        delay = REOPEN_DELAY
+        try:
+            while not self._stop_event.is_set():
+                try:
+                    if self._sock is None:
+                        self._sock = self._open()
+                    readable, _, _ = select.select([self._sock], [], [], 1.0)
+                    if not readable:
+                        continue
+                    data = self._sock.recv(65536)
+                except OSError as e:
+                    if e.errno == errno.ENOBUFS:
+                        # the events of a burst were dropped, a full sweep catches up with all of them
+                        log.warning("👂 Netlink events lost, the socket buffer is full")
+                        self._schedule_callback()
+                        continue
+                    log.error("👂 Netlink listener failed: %s, reopening in %s seconds", e, delay)
+                    self._close()
+                    self._stop_event.wait(delay)
+                    delay = min(delay * 2, REOPEN_MAX_DELAY)
+                    continue
+
+                delay = REOPEN_DELAY
+                changes = address_changes(data)
+                if changes:
+                    log.debug("IP address changes: %s", changes)
+                    self._schedule_callback()
+        finally:
+            self._close()
+
+    def _schedule_callback(self):
+        with self._timer_lock:
+            if self._timer is not None:
+                self._timer.cancel()
+            self._timer = threading.Timer(self.debounce, self._fire)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _fire(self):
+        log.info("👂 IP address change detected")
+        try:
+            self.callback()
+        except Exception:
+            log.exception("❌ IP address change callback failed")
+
+    def stop(self):
+        self._stop_event.set()
+        with self._timer_lock:
+            if self._timer is not None:
+                self._timer.cancel()
@@ -0,0 +1,474 @@
+#  -*- coding: utf-8 -*-
+#
+#              Copyright (C) 2018-2021 ProGeek
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import re
+import json
+import logging
+import threading
+import ipaddress
+
+from cloudflare_ddns.conf import settings
+from cloudflare_ddns.core.constants import DEFAULT_ACCOUNT
+from cloudflare_ddns.core.exceptions import ImproperlyConfigured
+from cloudflare_ddns.utils.records import normalize_name, parse_domain, match_zone
+
+log = logging.getLogger('cf_logging')
+
+RECORD_TYPES = ('A', 'AAAA')
+
+# keys that can be set in the defaults, on a zone or on a record of a records file
+RECORD_OPTIONS = ('record_type', 'ttl', 'proxied', 'state', 'account', 'ip_address')
+
+# the strings accepted for the proxied option, a bool() of 'false' would be True
+BOOLEAN_STRINGS = {'true': True, 'yes': True, 'on': True, '1': True,
+                   'false': False, 'no': False, 'off': False, '0': False}
+
+# most names a single pattern can expand to, a typo in a range must not exhaust the memory
+MAX_EXPANSION = 100000
+
+BRACE_RE = re.compile(r'\{([^{}]*)\}')
+RANGE_RE = re.compile(r'^(-?\d+)\.\.(-?\d+)$')
+LABEL_RE = re.compile(r'^(\*|[a-z0-9_]([a-z0-9_-]{0,61}[a-z0-9_])?)$')
+
+_plan = None
+_plan_lock = threading.Lock()
+
+
+class Record(object):
+    """A DNS record to keep updated, validated when the plan is built"""
+
+    __slots__ = ('name', 'zone', 'account', 'record_type', 'ttl', 'proxied', 'ip_address')
+
+    def __init__(self, name, zone, account, record_type, ttl, proxied, ip_address=None):
+        self.name = name
+        self.zone = zone
+        self.account = account
+        self.record_type = record_type
+        self.ttl = ttl
+        self.proxied = proxied
+        self.ip_address = ip_address
+
+    @property
+    def key(self):
+        """What identifies the record: two records with the same key would update the same DNS record"""
+        return self.account, self.record_type, self.name
+
+    def values(self):
+        return tuple(getattr(self, x) for x in self.__slots__)
+
+    def __eq__(self, other):
+        return isinstance(other, Record) and self.values() == other.values()
+
+    def __hash__(self):
+        return hash(self.values())
+
+    def __repr__(self):
+        return '<Record %s %s in %s>' % (self.record_type, self.name, self.zone)
+
+
+class Plan(object):
+    """The enabled DNS records, grouped by account and zone once for all the sweeps
+
+    :ivar records: tuple of Record
+    :ivar zones: dict with (account, zone name) as key and the tuple of its records as value
+    :ivar record_types: the record types for which the external IP must be resolved, the records
+        with their own ip_address don't need it
+    """
+
+    __slots__ = ('records', 'zones', 'record_types')
+
+    def __init__(self, records=()):
+        self.records = tuple(records)
+        zones = {}
+        for record in self.records:
+            zones.setdefault((record.account, record.zone), []).append(record)
+        self.zones = {key: tuple(value) for key, value in zones.items()}
+        self.record_types = frozenset(x.record_type for x in self.records if not x.ip_address)
+
+    def __len__(self):
+        return len(self.records)
+
+    def __iter__(self):
+        return iter(self.records)
+
+    def __repr__(self):
+        return '<Plan %d records in %d zones>' % (len(self.records), len(self.zones))
+
+
+def expand(pattern):
+    """Expand the braces of a name, like a shell: 'web-{1..3}' or '{eu,us}-edge'
+
+    A range keeps the zero padding of its bounds, 'host-{01..10}' gives host-01 to host-10.
+    Braces can't be nested.
+
+    :param pattern:
+    :return: list of names
+    """
+    match = BRACE_RE.search(pattern)
+    if not match:
+        if '{' in pattern or '}' in pattern:
+            raise ImproperlyConfigured("Unbalanced braces in %r" % pattern)
+        return [pattern]
+
+    body = match.group(1)
+    bounds = RANGE_RE.match(body)
+    if bounds:
+        start, end = int(bounds.group(1)), int(bounds.group(2))
+        if abs(end - start) >= MAX_EXPANSION:
+            raise ImproperlyConfigured("The range {%s} of %r is too large" % (body, pattern))
+        padded = [x for x in bounds.groups() if len(x.lstrip('-')) > 1 and x.lstrip('-').startswith('0')]
+        width = max(len(x) for x in bounds.groups()) if padded else 0
+        step = 1 if end >= start else -1
+        alternatives = ['%0*d' % (width, x) for x in range(start, end + step, step)]
+    elif ',' in body:
+        alternatives = body.split(',')
+    else:
+        raise ImproperlyConfigured("The braces {%s} of %r are neither a list nor a range" % (body, pattern))
+
+    head, tail = pattern[:match.start()], expand(pattern[match.end():])
+    if len(alternatives) * len(tail) > MAX_EXPANSION:
+        raise ImproperlyConfigured("%r expands to more than %d names" % (pattern, MAX_EXPANSION))
+    return [head + x + rest for x in alternatives for rest in tail]
+
+
+def qualify(name, zone):
+    """The fully qualified name of a record of a zone
+
+    :param name: '@' for the zone itself, a name relative to the zone, or a fully qualified
+        name of the zone, which may end with a dot
+    :param zone:
+    :return:
+    """
+    name = str(name).strip().lower()
+    if name == '@':
+        return zone
+    if name.endswith('.'):
+        name = name.rstrip('.')
+        if name != zone and not name.endswith('.' + zone):
+            raise ImproperlyConfigured("The DNS record %s is not in the zone %s" % (name, zone))
+        return name
+    if name == zone or name.endswith('.' + zone):
+        return name
+    return '%s.%s' % (name, zone)
+
+
+def validate_name(name):
+    """Check the name is a valid DNS record name, internationalized names are returned in punycode
+
+    :param name:
+    :return: the lower case name, without the root dot
+    """
+    name = normalize_name(str(name))
+    if not name.isascii():
+        try:
+            name = name.encode('idna').decode('ascii')
+        except UnicodeError:
+            raise ImproperlyConfigured("%r is not a valid domain name" % name)
+
+    labels = name.split('.')
+    if len(name) > 253 or len(labels) < 2 or not all(LABEL_RE.match(x) for x in labels) or '*' in labels[1:]:
+        raise ImproperlyConfigured("%r is not a valid DNS record name" % name)
+    return name
+
+
+def to_ttl(value, name):
+    """The TTL of a record as an int, like the int() the updates always applied to it
+
+    :param value:
+    :param name: the record name, used in the messages
+    :return:
+    """
+    if isinstance(value, bool):
+        raise ImproperlyConfigured("The TTL of %s must be a number of seconds, not %r" % (name, value))
+    try:
+        ttl = int(value)
+    except (TypeError, ValueError):
+        raise ImproperlyConfigured("The TTL of %s must be a number of seconds, not %r" % (name, value))
+    if not (ttl == 1 or 30 <= ttl <= 86400):
+        log.warning("⚙ The TTL %d of %s should be 1 (automatic) or between 30 and 86400", ttl, name)
+    return ttl
+
+
+def to_proxied(value, name):
+    """The proxied option of a record as a bool, the strings true/false, yes/no, on/off and 1/0 are accepted too
+
+    :param value:
+    :param name: the record name, used in the messages
+    :return:
+    """
+    if isinstance(value, str):
+        if value.strip().lower() not in BOOLEAN_STRINGS:
+            raise ImproperlyConfigured("The proxied of %s must be true or false, not %r" % (name, value))
+        return BOOLEAN_STRINGS[value.strip().lower()]
+    return bool(value)
+
+
+def make_records(name, zone, options, zones=None):
+    """The records of a name pattern, one for each name and record type
+
+    :param name: fully qualified name pattern
+    :param zone: name of the zone, None to find it from the name
+    :param options: the RECORD_OPTIONS, with the defaults already applied
+    :param zones: dict with the account as key and the set of its known zone names as value
+    :return: list of Record, empty when the state is disabled
+    """
+    if not options.get('state', True):
+        return []
+
+    record_types = options['record_type']
+    if isinstance(record_types, str):
+        record_types = [record_types]
+    record_types = [str(x).upper() for x in record_types]
+    for record_type in record_types:
+        if record_type not in RECORD_TYPES:
+            raise ImproperlyConfigured("DNS record type %s of %s is not supported, only %s" % (
+                record_type, name, ', '.join(RECORD_TYPES)))
+
+    ttl = to_ttl(options['ttl'], name)
+    proxied = to_proxied(options['proxied'], name)
+
+    account = options.get('account') or DEFAULT_ACCOUNT
+    if account != DEFAULT_ACCOUNT and account not in settings.CF_ACCOUNTS:
+        raise ImproperlyConfigured("The account %s of %s is not in CF_ACCOUNTS" % (account, name))
+
+    ip_address = options.get('ip_address')
+    if ip_address:
+        try:
+            version = ipaddress.ip_address(ip_address).version
+        except ValueError:
+            raise ImproperlyConfigured("The ip_address of %s is not an IP address: %r" % (name, ip_address))
+        if len(record_types) > 1 or {4: 'A', 6: 'AAAA'}[version] != record_types[0]:
+            raise ImproperlyConfigured("The ip_address %s of %s doesn't match its record type" % (ip_address, name))
+
+    records = []
+    for fqdn in expand(name):
+        fqdn = validate_name(fqdn)
+        record_zone = zone or find_zone(fqdn, (zones or {}).get(account))
+        records.extend(Record(fqdn, record_zone, account, record_type, ttl, proxied, ip_address or None)
+                       for record_type in record_types)
+    return records
+
+
+def find_zone(name, zones=None):
+    """The zone of a record name: a known zone of its account, or the registered domain
+
+    :param name:
+    :param zones: names of the known zones of the account of the record
+    :return:
+    """
+    return parse_domain(name, zones).fld
+
+
+def check_options(options, allowed, where):
+    unknown = set(options) - set(allowed)
+    if unknown:
+        raise ImproperlyConfigured("Unknown keys in %s: %s" % (where, ', '.join(sorted(unknown))))
+
+
+def subdomains_records(subdomains, zones=None):
+    """The records of the CF_SUBDOMAINS entries
+
+    :param subdomains: list of dicts with the dns_record, record_type, ttl, proxied, state and account keys
+    :param zones: dict with the account as key and the set of its known zone names as value
+    :return: list of Record
+    """
+    # an entry without 'state' has always been disabled
+    defaults = {'record_type': 'A', 'ttl': settings.CF_DEFAULT_TTL, 'proxied': settings.CF_PROXIED, 'state': False}
+
+    allowed = ('dns_record',) + RECORD_OPTIONS
+
+    records = []
+    for x in subdomains:
+        # the entries were always passed as keyword arguments and the other keys ignored, a settings file
+        # written for an older version must keep working
+        unknown = sorted(set(x) - set(allowed))
+        if unknown:
+            log.warning("⚙ Unknown keys of the CF_SUBDOMAINS entry %s are ignored: %s", x.get('dns_record'),
+                        ', '.join(unknown))
+        options = dict(defaults, **{k: v for k, v in x.items() if k in allowed})
+        records.extend(make_records(options.pop('dns_record'), None, options, zones))
+    return records
+
+
+def read_records_file(path):
+    """Parse a TOML, YAML or JSON records file, the format is chosen by the extension
+
+    :param path:
+    :return: the parsed document
+    """
+    extension = os.path.splitext(path)[1].lower()
+    try:
+        if extension == '.toml':
+            try:
+                import tomllib
+            except ImportError:
+                try:
+                    import tomli as tomllib
+                except ImportError:
+                    raise ImproperlyConfigured("TOML records files require Python 3.11+ or tomli: pip install tomli")
+            with open(path, 'rb') as fp:
+                return tomllib.load(fp)
+
+        if extension in ('.yaml', '.yml'):
+            try:
+                import yaml
+            except ImportError:
+                raise ImproperlyConfigured("YAML records files require PyYAML: pip install pyyaml")
+            with open(path, 'r', encoding='utf-8') as fp:
+                return yaml.safe_load(fp) or {}
+
+        if extension == '.json':
+            with open(path, 'r', encoding='utf-8') as fp:
+                return json.load(fp)
+    except ImproperlyConfigured:
+        raise
+    except Exception as e:
+        raise ImproperlyConfigured("The records file %s can't be read: %s" % (path, e)) from e
+
+    raise ImproperlyConfigured("The records file %s must be a .toml, .yaml, .yml or .json file" % path)
+
+
+def file_records(document, path='the records file'):
+    """The records of a records file
+
+        [defaults]
+        ttl = 1
+
+        [[zones]]
+        zone = "example.com"
+        proxied = true
+        records = ["@", "www", "web-{01..20}", {name = "{eu,us}-vpn", record_type = ["A", "AAAA"]}]
+
+    The options of a record are taken from the record, then from its zone, then from the defaults.
+
+    :param document: the parsed file
+    :param path: used in the error messages
+    :return: list of Record
+    """
+    check_options(document, ('defaults', 'zones'), path)
+    defaults = {'record_type': 'A', 'ttl': settings.CF_DEFAULT_TTL, 'proxied': settings.CF_PROXIED}
+    check_options(document.get('defaults') or {}, RECORD_OPTIONS, 'the defaults of %s' % path)
+    defaults.update(document.get('defaults') or {})
+
+    records = []
+    for zone_options in document.get('zones') or []:
+        zone = validate_name(zone_options.get('zone') or '')
+        check_options(zone_options, ('zone', 'records') + RECORD_OPTIONS, 'the zone %s of %s' % (zone, path))
+        zone_defaults = dict(defaults, **{k: v for k, v in zone_options.items() if k in RECORD_OPTIONS})
+
+        for x in zone_options.get('records') or []:
+            if not isinstance(x, dict):
+                x = {'name': x}
+            check_options(x, ('name',) + RECORD_OPTIONS, 'the record %s of %s' % (x.get('name'), zone))
+            options = dict(zone_defaults, **x)
+            name = options.pop('name', None)
+            if name is None:
+                raise ImproperlyConfigured("A record of the zone %s of %s has no name" % (zone, path))
+            records.extend(make_records(qualify(name, zone), zone, options))
+    return records
+
+
+def build_plan(zones=None):
+    """Compile the records of CF_SUBDOMAINS and of the CF_RECORDS_FILE in a plan
+
+    :param zones: dict with the account as key and the set of its known zone names as value, the
+        CF_SUBDOMAINS records of the other zones are split on the public suffix list
+    :return: Plan
+    """
+    records = subdomains_records(settings.CF_SUBDOMAINS, zones)
+    if settings.CF_RECORDS_FILE:
+        records.extend(file_records(read_records_file(settings.CF_RECORDS_FILE), settings.CF_RECORDS_FILE))
+
+    seen = {}
+    for record in records:
+        if record.key in seen:
+            raise ImproperlyConfigured("The %s record %s is configured twice" % (record.record_type, record.name))
+        seen[record.key] = record
+    return Plan(records)
+
+
+def get_plan(zones=None):
+    """The plan of the current settings, built on the first use
+
+    :param zones: the known zones of each account, see build_plan
+    :return: Plan
+    """
+    global _plan
+
+    if _plan is None:
+        with _plan_lock:
+            if _plan is None:
+                _plan = build_plan(zones)
+    return _plan
+
+
+def reload_plan(zones=None):
+    """Build the plan again, after the settings change. The current plan is kept when the new one is invalid
+
+    :param zones: the known zones of each account, see build_plan
+    :return: (old plan, new plan)
+    """
+    global _plan
+
+    plan = build_plan(zones)
+    with _plan_lock:
+        old, _plan = _plan, plan
+    return old, plan
+
+
+def split_zones(plan, zones):
+    """Move the records of a plan to the most specific of the zones
+
+    Once all the zones of the accounts are listed, the records of a zone delegated below
+    a registered domain, like sub.example.com, are grouped in their own zone. When the
+    plan is the plan of the settings, it is replaced for the next sweeps too.
+
+    :param plan: Plan
+    :param zones: dict with the account as key and the set of its zone names as value
+    :return: the same plan when no record moved, a new Plan otherwise
+    """
+    global _plan
+
+    records = []
+    for x in plan:
+        zone = match_zone(x.name, zones.get(x.account) or ())
+        if zone and zone != x.zone and zone.endswith('.' + x.zone):
+            x = Record(x.name, zone, x.account, x.record_type, x.ttl, x.proxied, x.ip_address)
+        records.append(x)
+    if records == list(plan.records):
+        return plan
+
+    new = Plan(records)
+    with _plan_lock:
+        if _plan is plan:
+            _plan = new
+    return new
+
+
+def diff_plans(old, new):
+    """The records added or changed by a new plan, and the ones it removes
+
+    :param old: Plan
+    :param new: Plan
+    :return: (changed, removed), lists of Record
+    """
+    before = {x.key: x for x in old or ()}
+    after = {x.key: x for x in new}
+    changed = [x for key, x in after.items() if before.get(key) != x]
+    removed = [x for key, x in before.items() if key not in after]
+    return changed, removed
@@ -0,0 +1,184 @@
+#  -*- coding: utf-8 -*-
+#
+#              Copyright (C) 2018-2021 ProGeek
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import time
+import threading
+from collections import Counter, deque
+
+
+class ProviderStats(object):
+    """Latency and health of one external IP service"""
+
+    __slots__ = ('name', 'latency', 'failure_rate', 'requests', 'failures', 'consecutive_failures', 'open_until')
+
+    def __init__(self, name):
+        self.name = name
+        self.latency = None
+        self.failure_rate = 0.0
+        self.requests = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+
+    def as_dict(self):
+        return {x: getattr(self, x) for x in self.__slots__ if x != 'name'}
+
+
+class ProviderRegistry(object):
+    """Keep an exponentially weighted moving average (EWMA) of latency and failure rate for each service
+
+    The services are ranked by their score, so the fast and healthy ones are queried
+    first. Every failure costs as much as `failure_penalty` seconds of latency in the
+    score. After `failure_threshold` consecutive failures the circuit of a service is
+    open and it is skipped for `cooldown` seconds, then it gets a new chance.
+    """
+
+    def __init__(self, alpha=0.3, failure_threshold=3, cooldown=600, failure_penalty=1.0):
+        self.alpha = alpha
+        self.failure_penalty = failure_penalty
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def _get(self, name):
+        stats = self._stats.get(name)
+        if stats is None:
+            stats = self._stats[name] = ProviderStats(name)
+        return stats
+
+    def record_success(self, name, latency):
+        with self._lock:
+            stats = self._get(name)
+            stats.requests += 1
+            stats.consecutive_failures = 0
+            stats.open_until = 0.0
+            stats.failure_rate = (1 - self.alpha) * stats.failure_rate
+            if stats.latency is None:
+                stats.latency = latency
+            else:
+                stats.latency = self.alpha * latency + (1 - self.alpha) * stats.latency
+
+    def record_failure(self, name, latency=None):
+        with self._lock:
+            stats = self._get(name)
+            stats.requests += 1
+            stats.failures += 1
+            stats.consecutive_failures += 1
+            stats.failure_rate = self.alpha + (1 - self.alpha) * stats.failure_rate
+            if latency is not None:
+                stats.latency = latency if stats.latency is None else max(stats.latency, latency)
+            if stats.consecutive_failures >= self.failure_threshold:
+                stats.open_until = time.monotonic() + self.cooldown
+
+    def is_available(self, name):
+        """Whether the circuit of the service is closed, or the cooldown is over
+
+        :param name:
+        :return:
+        """
+        with self._lock:
+            stats = self._stats.get(name)
+            return stats is None or stats.open_until <= time.monotonic()
+
+    def score(self, name):
+        """Expected cost of a query, lower is better. Unknown services score 0 so they are tried
+
+        :param name:
+        :return:
+        """
+        with self._lock:
+            stats = self._stats.get(name)
+            if stats is None:
+                return 0.0
+            return (stats.latency or 0.0) + stats.failure_rate * self.failure_penalty
+
+    def rank(self, names):
+        """Order the services from the best to the worst score, without the ones with an open circuit
+
+        When all the circuits are open, all the services are returned, so there is always
+        something to query.
+
+        :param names:
+        :return:
+        """
+        available = [x for x in names if self.is_available(x)] or list(names)
+        return sorted(available, key=self.score)
+
+    def snapshot(self):
+        """The statistics of all the services
+
+        :return: dict with the service name as key
+        """
+        with self._lock:
+            return {name: stats.as_dict() for name, stats in self._stats.items()}
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+
+class Hedge(object):
+    """What to query next while waiting for `quorum` external IP services to report the same IP
+
+    The threaded and the asyncio engines run the queries, the decisions are taken here. The
+    best `quorum` services are queried first. One more service is queried for each query that
+    ends without a public IP, and when no query ends within the hedge delay. So a slow service
+    doesn't delay the answer, and it doesn't keep the failed services from being replaced.
+    """
+
+    def __init__(self, names, quorum):
+        self.names = deque(names)
+        self.count = len(self.names)
+        self.quorum = min(quorum, self.count)
+        self.votes = Counter()
+        self.running = 0
+
+    def start(self, n):
+        """Take the next `n` services to query, fewer when there are no more
+
+        :param n:
+        :return: list of service names
+        """
+        names = [self.names.popleft() for _ in range(min(n, len(self.names)))]
+        self.running += len(names)
+        return names
+
+    def first(self):
+        return self.start(self.quorum)
+
+    def answered(self, ip_address):
+        """Count the answer of a query, None when it failed or wasn't a public IP
+
+        :param ip_address:
+        :return: the IP address once `quorum` services reported it, None otherwise
+        """
+        self.running -= 1
+        if not ip_address:
+            return None
+        self.votes[ip_address] += 1
+        return ip_address if self.votes[ip_address] >= self.quorum else None
+
+    def next(self, failed, waited):
+        """The services to query after a wait for the running queries
+
+        :param failed: how many queries ended without a public IP during the wait
+        :param waited: True when no query ended within the hedge delay
+        :return: list of service names
+        """
+        missing = self.quorum - max(self.votes.values(), default=0)
+        return self.start(max(failed + int(waited), missing - self.running))
@@ -0,0 +1,197 @@
+#  -*- coding: utf-8 -*-
+#
+#              Copyright (C) 2018-2021 ProGeek
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import sys
+import marshal
+import logging
+import threading
+import importlib.util
+
+from cloudflare_ddns.conf import settings
+
+log = logging.getLogger('cf_logging')
+
+# kind of rule that ends on a trie node, stored under the empty label
+RULE = 1
+EXCEPTION = 2
+
+_psl = None
+_psl_lock = threading.Lock()
+
+
+class DomainName(object):
+    """A domain name split in subdomain, domain and public suffix (tld), fld is the registered domain"""
+
+    __slots__ = ('subdomain', 'domain', 'tld', 'fld')
+
+    def __init__(self, subdomain, domain, tld):
+        self.subdomain = subdomain
+        self.domain = domain
+        self.tld = tld
+        self.fld = '.'.join(x for x in (domain, tld) if x)
+
+    def __repr__(self):
+        return '<DomainName %s|%s|%s>' % (self.subdomain, self.domain, self.tld)
+
+
+def bundled_psl_file():
+    """The public suffix list shipped with the tld package, found without importing it
+
+    :return: path of the file or None when tld is not installed
+    """
+    spec = importlib.util.find_spec('tld')
+    if spec is None or not spec.submodule_search_locations:
+        return None
+    return os.path.join(spec.submodule_search_locations[0], 'res', 'effective_tld_names.dat.txt')
+
+
+def read_rules(path):
+    """The rules of a public suffix list file, the internationalized ones also in punycode
+
+    Cloudflare returns the DNS record names in punycode, so both forms must match.
+
+    :param path:
+    :return: generator of rules
+    """
+    with open(path, 'r', encoding='utf-8') as fp:
+        for line in fp:
+            rule = line.split(None, 1)[0].lower() if line.strip() else ''
+            if not rule or rule.startswith('//'):
+                continue
+            yield rule
+
+            if not rule.isascii():
+                exception = '!' if rule.startswith('!') else ''
+                try:
+                    yield exception + '.'.join(
+                        x if x == '*' else x.encode('idna').decode('ascii') for x in rule.lstrip('!').split('.'))
+                except UnicodeError:
+                    pass
+
+
+def compile_trie(rules):
+    """Build a trie of the rules, keyed by the labels from right to left
+
+    :param rules: PSL rules like 'co.uk', '*.kawasaki.jp' or '!city.kawasaki.jp'
+    :return: nested dicts, the kind of the rule ending on a node is stored under ''
+    """
+    root = {}
+    for rule in rules:
+        kind = EXCEPTION if rule.startswith('!') else RULE
+        node = root
+        for label in reversed(rule.lstrip('!').split('.')):
+            node = node.setdefault(label, {})
+        node[''] = kind
+    return root
+
+
+class PublicSuffixList(object):
+    """Split domain names with the public suffix list, compiled once in a reversed-label trie
+
+    A lookup walks at most one trie node for each label of the name, from the TLD to the left.
+    """
+
+    def __init__(self, trie):
+        self._trie = trie
+
+    @classmethod
+    def load(cls, path=None, cache_path=None):
+        """Compile the public suffix list, or load it from the cache file when is up-to-date
+
+        The cache is a marshal dump of the trie, it's rebuilt when the list or the Python version changes.
+
+        :param path: the public suffix list file, by default the one shipped with tld
+        :param cache_path: file used to keep the compiled trie, None compiles it on every start
+        :return:
+        """
+        path = path or bundled_psl_file()
+        if not path:
+            raise FileNotFoundError("No public suffix list found, install tld or set PSL_FILE")
+
+        stat = os.stat(path)
+        key = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size, sys.implementation.cache_tag)
+
+        if cache_path and os.path.exists(cache_path):
+            try:
+                with open(cache_path, 'rb') as fp:
+                    cached_key, trie = marshal.loads(fp.read())
+                if cached_key == key:
+                    return cls(trie)
+            except (OSError, EOFError, ValueError, TypeError) as e:
+                log.warning("🗃 Public suffix cache %s can't be read: %s", cache_path, e)
+
+        trie = compile_trie(read_rules(path))
+
+        if cache_path:
+            try:
+                tmp_path = cache_path + '.tmp'
+                with open(tmp_path, 'wb') as fp:
+                    fp.write(marshal.dumps((key, trie)))
+                os.replace(tmp_path, cache_path)
+            except OSError as e:
+                log.warning("🗃 Public suffix cache %s can't be written: %s", cache_path, e)
+        return cls(trie)
+
+    def suffix_length(self, labels):
+        """How many labels, from the right, are the public suffix
+
+        :param labels: labels of the domain name
+        :return: 1 when no rule matches, the implicit '*' rule of the list
+        """
+        node = self._trie
+        length = 1
+        for i, label in enumerate(reversed(labels)):
+            child = node.get(label)
+            if child is not None and child.get('') == EXCEPTION:
+                # an exception rule is a suffix without its leftmost label
+                return i
+            wildcard = node.get('*')
+            if wildcard is not None and wildcard.get('') == RULE:
+                length = i + 1
+            if child is None:
+                break
+            if child.get('') == RULE:
+                length = i + 1
+            node = child
+        return length
+
+    def split(self, name):
+        """Split a domain name in subdomain, domain and public suffix
+
+        :param name: lower case domain name, without the root dot
+        :return: DomainName, the domain is empty when the name is itself a public suffix
+        """
+        labels = name.split('.')
+        length = self.suffix_length(labels)
+        if length >= len(labels):
+            return DomainName('', '', name)
+        return DomainName('.'.join(labels[:-length - 1]), labels[-length - 1], '.'.join(labels[-length:]))
+
+
+def get_public_suffix_list():
+    """The public suffix list shared by the whole script, loaded on the first use
+
+    :return:
+    """
+    global _psl
+
+    if _psl is None:
+        with _psl_lock:
+            if _psl is None:
+                _psl = PublicSuffixList.load(settings.PSL_FILE, settings.PSL_CACHE_FILE)
+    return _psl
@@ -0,0 +1,170 @@
+#  -*- coding: utf-8 -*-
+#
+#              Copyright (C) 2018-2021 ProGeek
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import re
+import time
+import random
+import threading
+
+from cloudflare_ddns.conf import settings
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+_ratelimit_re = re.compile(r'\b([rt])=(\d+)')
+
+
+class TokenBucket(object):
+    """Thread safe token bucket, refilled with `rate` tokens per second up to `capacity`
+
+    A request reserves a token and gets back how many seconds it has to wait before
+    being sent. The bucket may go below zero, so the waiting requests are spread over
+    time instead of all being sent as soon as a token is available. A rate of 0
+    disables the limiter.
+    """
+
+    def __init__(self, rate, capacity, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self._clock = clock
+        self._tokens = capacity
+        self._updated_at = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    def reserve(self, tokens=1):
+        """Take tokens from the bucket
+
+        :param tokens:
+        :return: seconds to wait before sending the request
+        """
+        if not self.rate:
+            return 0.0
+        with self._lock:
+            self._refill(self._clock())
+            self._tokens -= tokens
+            return max(0.0, -self._tokens / self.rate)
+
+    def pause(self, seconds):
+        """No token is given for `seconds`, when the API asks to retry later
+
+        :param seconds:
+        :return:
+        """
+        if not self.rate:
+            return
+        with self._lock:
+            self._refill(self._clock())
+            self._tokens = min(self._tokens, -seconds * self.rate)
+
+    def observe(self, remaining, reset=None):
+        """Align the bucket with the quota left reported by the API, shared with other clients of the same user
+
+        :param remaining: requests left in the current window
+        :param reset: seconds until the window is reset
+        :return:
+        """
+        if remaining <= 0 and reset:
+            self.pause(reset)
+        elif self.rate:
+            with self._lock:
+                self._refill(self._clock())
+                self._tokens = min(self._tokens, remaining)
+
+
+def parse_retry_after(value):
+    """Seconds to wait from a Retry-After header, in seconds or as an HTTP date
+
+    :param value:
+    :return: None when the header is missing or invalid
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+
+    from email.utils import parsedate_to_datetime
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_ratelimit(value):
+    """Requests left and seconds to the reset from a `Ratelimit: "default";r=1195;t=240` header
+
+    :param value:
+    :return: (remaining, reset) or None when the header is missing or invalid
+    """
+    fields = dict(_ratelimit_re.findall(value or ''))
+    if 'r' not in fields:
+        return None
+    return int(fields['r']), int(fields.get('t', 0))
+
+
+def backoff_delay(attempt, base=None, cap=None):
+    """Exponential backoff with full jitter
+
+    :param attempt: number of the retry, starting from 0
+    :param base: delay of the first retry
+    :param cap: longest delay
+    :return: seconds to wait
+    """
+    if base is None:
+        base = settings.CF_RETRY_BACKOFF
+    if cap is None:
+        cap = settings.CF_RETRY_BACKOFF_MAX
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def observe_headers(limiter, headers):
+    """Feed the rate limit headers of a Cloudflare response to the limiter
+
+    :param limiter: TokenBucket
+    :param headers: case insensitive mapping of the response headers
+    :return: seconds to wait before retrying, None when there is no Retry-After
+    """
+    ratelimit = parse_ratelimit(headers.get('Ratelimit'))
+    if ratelimit:
+        limiter.observe(*ratelimit)
+    return parse_retry_after(headers.get('Retry-After'))
+
+
+def get_limiter(name='default', rate=None, capacity=None):
+    """A named token bucket shared by all the Cloudflare clients and threads
+
+    :param name: one limiter for each API user
+    :param rate: requests per second, used only when the limiter is created
+    :param capacity: largest burst of requests, used only when the limiter is created
+    :return:
+    """
+    limiter = _limiters.get(name)
+    if limiter is None:
+        with _limiters_lock:
+            limiter = _limiters.get(name)
+            if limiter is None:
+                if rate is None:
+                    rate = settings.CF_RATE_LIMIT / settings.CF_RATE_LIMIT_PERIOD
+                if capacity is None:
+                    capacity = settings.CF_RATE_LIMIT_BURST
+                limiter = _limiters[name] = TokenBucket(rate, capacity)
+    return limiter
@@ -0,0 +1,109 @@
+#  -*- coding: utf-8 -*-
+#
+#              Copyright (C) 2018-2021 ProGeek
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from collections import Counter
+
+from cloudflare_ddns.utils.psl import DomainName, get_public_suffix_list
+
+
+def parse_domain(name, zones=None):
+    """Split a domain name in subdomain and registered domain
+
+    :param name: the fully qualified domain name
+    :param zones: names of the known zones, like the keys of get_zones_ids(). When the name
+        belongs to one of them, it is split on the zone instead of the public suffix list, so
+        zones delegated below a registered domain are found too
+    :return: DomainName with the subdomain, domain, tld and fld attributes
+    """
+    name = normalize_name(name)
+    if zones:
+        zone = match_zone(name, zones)
+        if zone:
+            domain, _, suffix = zone.partition('.')
+            return DomainName(name[:-len(zone)].rstrip('.'), domain, suffix)
+    return get_public_suffix_list().split(name)
+
+
+def match_zone(name, zones):
+    """The longest zone the domain name belongs to
+
+    :param name: lower case domain name, without the root dot
+    :param zones: set or dict of lower case zone names
+    :return: the zone name or None
+    """
+    labels = name.split('.')
+    for i in range(len(labels)):
+        zone = '.'.join(labels[i:])
+        if zone in zones:
+            return zone
+    return None
+
+
+def normalize_name(name):
+    """Cloudflare record names are lower case and without the root dot
+
+    :param name:
+    :return:
+    """
+    return name.rstrip('.').lower()
+
+
+class RecordStore(object):
+    """DNS records indexed by (zone_id, type, fully qualified name)
+
+    The index is built once for each listing of the zone DNS records, so finding
+    a record doesn't need to parse any domain name.
+    """
+
+    __slots__ = ('_records', '_counts')
+
+    def __init__(self, records=()):
+        self._records = {}
+        self._counts = Counter()
+        for record in records:
+            self.add(record)
+
+    def add(self, record):
+        key = (record['zone_id'], record['type'], normalize_name(record['name']))
+        if key not in self._records:
+            self._counts[key[:2]] += 1
+        self._records[key] = record
+
+    def get(self, zone_id, record_type, name):
+        """The record of a zone with this type and name, None if is missing
+
+        :param zone_id:
+        :param record_type:
+        :param name: the fully qualified domain name
+        :return:
+        """
+        return self._records.get((zone_id, record_type, normalize_name(name)))
+
+    def count(self, zone_id, record_type):
+        """How many records of this type the zone has
+
+        :param zone_id:
+        :param record_type:
+        :return:
+        """
+        return self._counts[(zone_id, record_type)]
+
+    def __len__(self):
+        return len(self._records)
+
+    def __iter__(self):
+        return iter(self._records.values())
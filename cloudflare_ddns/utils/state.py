@@ -0,0 +1,65 @@
+#  -*- coding: utf-8 -*-
+#
+#              Copyright (C) 2018-2021 ProGeek
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from cloudflare_ddns.utils.cache import TTLCache
+from cloudflare_ddns.utils.records import normalize_name
+
+
+class AppliedState(TTLCache):
+    """Last IP address successfully applied to each DNS record
+
+    While the external IP doesn't change, a DNS record found here needs no request to
+    the Cloudflare API. The entries expire after `ttl` seconds, which forces a periodic
+    verification against Cloudflare to catch the records edited by someone else.
+    A `ttl` of 0 disables the fast path and every record is always verified.
+    """
+
+    @staticmethod
+    def key(record_type, name):
+        return '%s:%s' % (record_type, normalize_name(name))
+
+    def is_applied(self, record_type, name, ip_address):
+        """Whether the IP address is the last one applied to the DNS record
+
+        :param record_type:
+        :param name: the fully qualified domain name
+        :param ip_address:
+        :return:
+        """
+        if not self.ttl or not ip_address:
+            return False
+        state = self.get(self.key(record_type, name))
+        return bool(state) and state['ip'] == ip_address
+
+    def remember(self, record, ip_address):
+        """Save the IP address applied to the DNS record
+
+        :param record: the DNS record returned by Cloudflare
+        :param ip_address:
+        :return:
+        """
+        if not self.ttl:
+            return
+        self.set(self.key(record['type'], record['name']), {
+            'ip': ip_address,
+            'record_id': record.get('id'),
+            'zone_id': record.get('zone_id'),
+            'modified_on': record.get('modified_on'),
+        })
+
+    def forget(self, record_type, name):
+        self.delete(self.key(record_type, name))
@@ -0,0 +1,78 @@
+#  -*- coding: utf-8 -*-
+#
+#              Copyright (C) 2018-2021 ProGeek
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import sys
+import logging
+import threading
+
+log = logging.getLogger('cf_logging')
+
+
+def module_file(module_name):
+    """Path of the source file of an imported module
+
+    :param module_name: like the CLOUDFLARE_SETTINGS_MODULE
+    :return: None when the module is not imported or has no file
+    """
+    module = sys.modules.get(module_name)
+    return getattr(module, '__file__', None)
+
+
+class FileWatcher(threading.Thread):
+    """Poll the modification time of a file and call `callback` when it changes
+
+    An editor can write a file in more than one step, so the callback runs only after
+    the file stayed unchanged for one more interval.
+    """
+
+    def __init__(self, path, callback, interval=1):
+        super().__init__(name='file_watcher', daemon=True)
+        self.path = path
+        self.callback = callback
+        self.interval = interval
+        self._stop_event = threading.Event()
+
+    def stat(self):
+        try:
+            stat = os.stat(self.path)
+            return stat.st_mtime_ns, stat.st_size
+        except OSError:
+            return None
+
+    def run(self):
+        log.info("👀 Watching %s for changes", self.path)
+        last = self.stat()
+        pending = False
+        while not self._stop_event.wait(self.interval):
+            current = self.stat()
+            if current != last:
+                last = current
+                pending = True
+            elif pending:
+                pending = False
+                self._fire()
+
+    def _fire(self):
+        log.info("👀 %s changed", self.path)
+        try:
+            self.callback()
+        except Exception:
+            log.exception("❌ File change callback failed")
+
+    def stop(self):
+        self._stop_event.set()
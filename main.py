@@ -18,61 +18,521 @@
 import os
 import sys
 import time
+import random
+import signal
 import logging
 import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-import schedule
-
+import cloudflare_ddns
 from cloudflare_ddns.conf import settings
-from cloudflare_ddns.utils.log import configure_logging
+from cloudflare_ddns.utils.utils import load_arguments
 # from libs.utils import load_arguments, load_conf
 # from libs.logging.logging import configure_logging
 
-from cloudflare_ddns.Cloudflare import Cloudflare
+from cloudflare_ddns.Cloudflare import Cloudflare, DEFAULT_ACCOUNT, record_ip_address, flush_caches, known_zones
+from cloudflare_ddns.utils.ips import resolve_external_ips, clear_ip_cache, provider_stats, shutdown_executor
+from cloudflare_ddns.utils.http import close_sessions
+from cloudflare_ddns.utils import netlink, metrics
+from cloudflare_ddns.utils.plan import Plan, get_plan, reload_plan, diff_plans, split_zones
+from cloudflare_ddns.utils.watch import FileWatcher, module_file
 
 log = logging.getLogger('cf_logging')
 schedule_logger = logging.getLogger('schedule')
 
+# set when the host IP addresses change and a sweep must run right away
+reconcile_now = threading.Event()
+
+# set by SIGHUP, or when the settings file changes, to reload the settings
+reload_requested = threading.Event()
+
 
-def cloudflare_job(**kwargs):
+def cloudflare_job(record, account=DEFAULT_ACCOUNT):
+    """Update a single DNS record
+
+    :param record: Record of the plan
+    :param account: name of the account of CF_ACCOUNTS that owns the record
+    :return:
     """
+    cf = Cloudflare(account=account)
+    cf(subdomain=record.name, record_type=record.record_type, ttl=record.ttl, proxied=record.proxied,
+       ip_address=record.ip_address)
+    flush_caches()
 
-    :param kwargs:
+
+def cloudflare_zone_job(zone, records, ip_addresses, account=DEFAULT_ACCOUNT):
+    """Update all the DNS records of a zone
+
+    :param zone: name of the zone
+    :param records: Record of the plan that belong to the zone
+    :param ip_addresses: IP address already resolved for each record type
+    :param account: name of the account of CF_ACCOUNTS that owns the zone
     :return:
     """
-    cf = Cloudflare()
-    cf(subdomain=kwargs['dns_record'], record_type=kwargs['record_type'], ttl=kwargs['ttl'], proxied=kwargs['proxied'])
+    cf = Cloudflare(account=account)
+    cf.update_zone_records(zone, records, ip_addresses=ip_addresses)
+
+
+def account_zones():
+    """The zones of each account already in the zone cache, the records of the plan are split on them
+
+    :return: dict with the account as key and the set of its zone names as value
+    """
+    return {x: known_zones(x) for x in [DEFAULT_ACCOUNT, *settings.CF_ACCOUNTS]}
 
 
 def cloudflare_generator():
     while True:
-        for x in settings.CF_SUBDOMAINS:
-            if x.get('state'):
-                run_threaded(cloudflare_job, **x)
-                yield
+        records = get_plan(account_zones()).records
+        if not records:
+            yield
+        for x in records:
+            run_jobs([(x.name, cloudflare_job, {'record': x, 'account': x.account})])
+            yield
+
+
+def records_with_ip(records, ip_addresses):
+    """Drop the DNS records that have no IP address, neither their own nor the external IP of their type
+
+    :param records: Record of the plan
+    :param ip_addresses: IP address resolved for each record type
+    :return:
+    """
+    for x in [x for x in records if not record_ip_address(x, ip_addresses)]:
+        log.error("🧩 No external IP for %s record %s, skipping", x.record_type, x.name)
+        metrics.records.inc(result='failed')
+    return [x for x in records if record_ip_address(x, ip_addresses)]
+
+
+def zones_with_ip(plan, ip_addresses):
+    """The zones of the plan with their DNS records that have an IP address
+
+    :param plan: Plan
+    :param ip_addresses: IP address resolved for each record type
+    :return: list of ((account, zone name), records)
+    """
+    zones = [(key, records_with_ip(records, ip_addresses)) for key, records in plan.zones.items()]
+    return [(key, records) for key, records in zones if records]
+
+
+def pending_accounts(plan, ip_addresses):
+    """The accounts with DNS records that don't have the external IP applied yet, only they need their zone ids
+
+    :param plan: Plan
+    :param ip_addresses: IP address resolved for each record type
+    :return: set of account names
+    """
+    applied_state = Cloudflare.applied_state
+    return {x.account for x in plan
+            if not applied_state.is_applied(x.record_type, x.name, record_ip_address(x, ip_addresses))}
+
+
+def zoned_plan(plan, found):
+    """The plan with its records moved to the zones found by listing the zones of the accounts
+
+    :param plan: Plan
+    :param found: True when the listing found zones that were not known
+    :return: Plan
+    """
+    if not found:
+        return plan
+    return split_zones(plan, account_zones())
+
+
+def discover_zones(plan, ip_addresses):
+    """List all the zones of the accounts with records to update, at most once every CF_ZONE_CACHE_TTL
+
+    A sweep with nothing to update doesn't call the Cloudflare API.
+
+    :param plan: Plan
+    :param ip_addresses: IP address resolved for each record type
+    :return: the plan with the records of the delegated zones in their own zone
+    """
+    try:
+        found = [Cloudflare(account=x).list_zones() for x in pending_accounts(plan, ip_addresses)]
+    except Exception:
+        log.exception("🗂 The zones of the accounts can't be listed")
+        return plan
+    return zoned_plan(plan, any(found))
+
+
+def cloudflare_sweep(plan=None):
+    """Reconcile all the enabled DNS records in a single sweep
+
+    :param plan: Plan of the DNS records to reconcile, by default the plan of the settings
+    :return:
+    """
+    start = time.perf_counter()
+    plan = get_plan(account_zones()) if plan is None else plan
+    log.info("🔁 Start sweep for %d DNS records", len(plan))
+
+    # the external IP's are resolved only once and shared by all the DNS records
+    ip_addresses = resolve_external_ips(plan.record_types)
+    if log.isEnabledFor(logging.DEBUG):
+        log.debug("External IP services: %s", provider_stats.snapshot())
+
+    plan = discover_zones(plan, ip_addresses)
+
+    # each zone DNS records are listed only once for all the configured records of the zone
+    run_jobs([
+        (zone, cloudflare_zone_job,
+         {'zone': zone, 'records': zone_records, 'ip_addresses': ip_addresses, 'account': account})
+        for (account, zone), zone_records in zones_with_ip(plan, ip_addresses)
+    ], jitter=settings.SCHEDULE_RECORD_JITTER)
+    flush_caches()
+    metrics.sweep_duration.observe(time.perf_counter() - start)
+
+
+async def cloudflare_async_zone_job(cf, zone, records, ip_addresses):
+    """Update all the DNS records of a zone with the asyncio engine
+
+    :param cf: AsyncCloudflare client
+    :param zone: name of the zone
+    :param records: Record of the plan that belong to the zone
+    :param ip_addresses: IP address already resolved for each record type
+    :return:
+    """
+    import asyncio
+
+    if settings.SCHEDULE_RECORD_JITTER:
+        await asyncio.sleep(random.uniform(0, settings.SCHEDULE_RECORD_JITTER))
+    await cf.update_zone_records(zone, records, ip_addresses=ip_addresses)
+
+
+async def cloudflare_async_sweep(cf, plan=None):
+    """Reconcile all the enabled DNS records in a single sweep, all the zones are updated concurrently
+
+    :param cf: AsyncCloudflare client
+    :param plan: Plan of the DNS records to reconcile, by default the plan of the settings
+    :return:
+    """
+    import asyncio
+
+    start = time.perf_counter()
+    plan = get_plan(account_zones()) if plan is None else plan
+    log.info("🔁 Start sweep for %d DNS records", len(plan))
+
+    ip_addresses = await cf.resolve_external_ips(plan.record_types)
+    if log.isEnabledFor(logging.DEBUG):
+        log.debug("External IP services: %s", provider_stats.snapshot())
+
+    try:
+        found = [await cf.for_account(x).list_zones() for x in pending_accounts(plan, ip_addresses)]
+        plan = zoned_plan(plan, any(found))
+    except Exception:
+        log.exception("🗂 The zones of the accounts can't be listed")
+
+    zones = zones_with_ip(plan, ip_addresses)
+    results = await asyncio.gather(
+        *(cloudflare_async_zone_job(cf.for_account(account), zone, zone_records, ip_addresses)
+          for (account, zone), zone_records in zones),
+        return_exceptions=True
+    )
+    for ((account, zone), _), result in zip(zones, results):
+        if isinstance(result, Exception):
+            log.error("❌ Update of zone %s failed: %r", zone, result)
+            metrics.jobs_failed.inc()
+    flush_caches()
+    metrics.sweep_duration.observe(time.perf_counter() - start)
+
+
+async def cloudflare_async_loop():
+    """Run a sweep every SCHEDULE_DELAY_TASKS seconds with the asyncio engine
+
+    :return:
+    """
+    import asyncio
+    from cloudflare_ddns.AsyncCloudflare import AsyncCloudflare
+
+    loop = asyncio.get_running_loop()
+    wake_up = asyncio.Event()
+
+    def on_change():
+        clear_ip_cache()
+        loop.call_soon_threadsafe(wake_up.set)
+
+    def on_reload():
+        reload_requested.set()
+        loop.call_soon_threadsafe(wake_up.set)
+
+    monitor = start_address_monitor(on_change)
+    start_reload_triggers(on_reload)
+
+    async with AsyncCloudflare() as cf:
+        while True:
+            try:
+                await asyncio.wait_for(wake_up.wait(), timeout=polling_delay(monitor))
+            except asyncio.TimeoutError:
+                pass
+            wake_up.clear()
+
+            if reload_requested.is_set():
+                reload_requested.clear()
+                changed = reload_settings()
+                if changed is not None:
+                    cf.reload_credentials()
+                if changed:
+                    await cloudflare_async_sweep(cf, changed)
+                continue
+
+            await cloudflare_async_sweep(cf)
+
+
+async def cloudflare_async_once():
+    """Run a single sweep with the asyncio engine
+
+    :return:
+    """
+    from cloudflare_ddns.AsyncCloudflare import AsyncCloudflare
+
+    async with AsyncCloudflare() as cf:
+        await cloudflare_async_sweep(cf)
+
+
+def update_now():
+    """Update all the DNS records once and return, for cron jobs and network hooks
+
+    The zone ids and the applied IP's survive between the runs with CF_ZONE_CACHE_FILE
+    and CF_STATE_FILE, so a run with nothing to change only asks the external IP services,
+    it doesn't call the Cloudflare API. benchmarks/check_update_now.py checks it.
+
+    :return: True when all the DNS records are up-to-date, False when any of them or any job failed
+    """
+    failures = metrics.records.value(result='failed') + metrics.jobs_failed.value()
+    if settings.SCHEDULE_ENGINE == 'asyncio':
+        import asyncio
+        asyncio.run(cloudflare_async_once())
+    else:
+        cloudflare_sweep()
+        shutdown_executors()
+    close_sessions()
+    shutdown_executor()
+    return metrics.records.value(result='failed') + metrics.jobs_failed.value() == failures
+
+
+def on_address_change():
+    """Called by the netlink listener when the host IP addresses change
+
+    :return:
+    """
+    clear_ip_cache()
+    reconcile_now.set()
+
+
+def start_address_monitor(callback):
+    """Start the netlink listener that calls back when the host IP addresses change
+
+    :param callback:
+    :return: the running AddressMonitor or None when is disabled or not supported
+    """
+    if not settings.NETLINK_MONITOR:
+        return None
+    if not netlink.is_supported():
+        log.warning("👂 Netlink is not supported on %s, the DNS records are only polled", sys.platform)
+        return None
+
+    monitor = netlink.AddressMonitor(callback, debounce=settings.NETLINK_DEBOUNCE)
+    monitor.start()
+    return monitor
+
+
+def reload_settings():
+    """Import the settings module again, the DNS records added or changed must be reconciled
+
+    The HTTP sessions, the zone cache and the applied state of the other records are kept.
+    The thread pools, the rate limiters, the netlink listener and the logging keep the
+    settings they were started with.
+
+    :return: Plan of the added or changed records, None when the settings can't be reloaded
+    """
+    plans = []
+
+    def check():
+        # the plan of the new settings is built before they are used, invalid records keep the old ones
+        plans.extend(reload_plan(account_zones()))
+
+    try:
+        settings.reload(check=check)
+    except Exception:
+        log.exception("⚙ Settings can't be reloaded, the current DNS records are kept")
+        return None
+
+    old_plan, plan = plans
+    changed, removed = diff_plans(old_plan, plan)
+    # a changed TTL or proxied flag is not in the applied state, the records must be checked again
+    for x in changed + removed:
+        Cloudflare.applied_state.forget(x.record_type, x.name)
+
+    log.info("⚙ Settings reloaded: %d DNS records added or changed, %d removed", len(changed), len(removed))
+    return Plan(changed)
+
+
+def start_reload_triggers(callback):
+    """Call back on SIGHUP, and when the settings file or the CF_RECORDS_FILE change if SETTINGS_WATCH is enabled
+
+    :param callback: called from the signal handler or from the watcher threads
+    :return: list of the running FileWatcher
+    """
+    if hasattr(signal, 'SIGHUP'):
+        signal.signal(signal.SIGHUP, lambda signum, frame: callback())
+
+    if not settings.SETTINGS_WATCH:
+        return []
+    path = module_file(settings.SETTINGS_MODULE)
+    if not path:
+        log.warning("👀 The settings module %s has no file to watch", settings.SETTINGS_MODULE)
+
+    watchers = [FileWatcher(x, callback) for x in (path, settings.CF_RECORDS_FILE) if x]
+    for watcher in watchers:
+        watcher.start()
+    return watchers
+
+
+def schedule_sweeps(monitor):
+    """Register the polling job of the SCHEDULE_MODE with the schedule loop
+
+    :param monitor: the running AddressMonitor or None
+    :return:
+    """
+    import schedule
+
+    if settings.SCHEDULE_MODE == 'record':
+        schedule.every(polling_delay(monitor)).seconds.do(lambda: next(generator_job))
+    else:
+        schedule.every(polling_delay(monitor)).seconds.do(cloudflare_sweep)
+
+
+def polling_delay(monitor):
+    """Seconds between two polling sweeps, longer when the netlink listener reports the changes
+
+    :param monitor: the running AddressMonitor or None
+    :return:
+    """
+    if monitor is not None and settings.NETLINK_POLL_DELAY:
+        return settings.NETLINK_POLL_DELAY
+    return settings.SCHEDULE_DELAY_TASKS
 
 
 generator_job = cloudflare_generator()
 
 
-def run_threaded(job_func, **kwargs):
-    job_thread = threading.Thread(target=job_func, kwargs=kwargs)
-    job_thread.daemon = True
-    job_thread.name = kwargs['dns_record']
-    job_thread.start()
-    job_thread.join()
+_executors = {}
+_executors_lock = threading.Lock()
+
+
+def get_executor(account=DEFAULT_ACCOUNT):
+    """The thread pool that runs the jobs of an account, at most SCHEDULE_MAX_WORKERS at the same time
+
+    Every account has its own pool, so the accounts are served in parallel and a slow
+    or rate limited account does not hold back the others.
+
+    :param account: name of the account of CF_ACCOUNTS
+    :return:
+    """
+    with _executors_lock:
+        executor = _executors.get(account)
+        if executor is None:
+            executor = _executors[account] = ThreadPoolExecutor(max_workers=settings.SCHEDULE_MAX_WORKERS,
+                                                                thread_name_prefix='cf_job_%s' % account)
+    return executor
+
+
+def shutdown_executors():
+    """Stop the thread pools of all the accounts
+
+    :return:
+    """
+    with _executors_lock:
+        for executor in _executors.values():
+            executor.shutdown(wait=False)
+        _executors.clear()
+
+
+def run_timed(name, job_func, kwargs, jitter=0):
+    """Run a job and log its exception, if any
+
+    :param name: name of the job used in the log
+    :param job_func:
+    :param kwargs: arguments of the job
+    :param jitter: maximum random delay, in seconds, before the job starts
+    :return: how many seconds the job took to run
+    """
+    if jitter:
+        time.sleep(random.uniform(0, jitter))
+
+    start = time.perf_counter()
+    try:
+        job_func(**kwargs)
+    except Exception:
+        log.exception("❌ Job %s failed", name)
+        metrics.jobs_failed.inc()
+    return time.perf_counter() - start
+
+
+def run_jobs(jobs, jitter=0):
+    """Run the jobs on the thread pool of their account and wait until all of them are done
+
+    :param jobs: list of (name, job_func, kwargs), the account is read from kwargs
+    :param jitter: maximum random delay, in seconds, before each job starts
+    :return:
+    """
+    start = time.perf_counter()
+    futures = [get_executor(kwargs.get('account') or DEFAULT_ACCOUNT).submit(run_timed, name, job_func, kwargs, jitter)
+               for name, job_func, kwargs in jobs]
+    serial = sum(future.result() for future in as_completed(futures))
+
+    if len(futures) > 1:
+        log.info("⏱ %d jobs done in %.2fs, %.2fs when run serially", len(futures), time.perf_counter() - start,
+                 serial)
 
 
 if __name__ == '__main__':
+    arguments = load_arguments()
+    cloudflare_ddns.setup()
+
+    # a mistake in the DNS records stops the script now, not on the first sweep
+    get_plan(account_zones())
+
+    if arguments.update_now:
+        # cron jobs and network hooks see the failures in the exit status
+        sys.exit(0 if update_now() else 1)
+
     log.info("Start the Cloudflare DDNS script")
 
-    schedule.every(settings.SCHEDULE_DELAY_TASKS).seconds.do(lambda: next(generator_job))
+    if settings.METRICS_PORT:
+        metrics.start_metrics_server(settings.METRICS_ADDRESS, settings.METRICS_PORT)
+
+    if settings.SCHEDULE_ENGINE == 'asyncio':
+        import asyncio
+        try:
+            asyncio.run(cloudflare_async_loop())
+        except KeyboardInterrupt:
+            log.warning("Cloudflare DDNS script interrupted")
+            sys.exit(1)
+
+    import schedule
+
+    address_monitor = start_address_monitor(on_address_change)
+    start_reload_triggers(reload_requested.set)
+    schedule_sweeps(address_monitor)
 
     try:
         while True:
             schedule.run_pending()
-            time.sleep(1)
+            if reconcile_now.wait(1):
+                reconcile_now.clear()
+                cloudflare_sweep()
+            if reload_requested.is_set():
+                reload_requested.clear()
+                changed = reload_settings()
+                if changed is not None:
+                    # the polling delay and the SCHEDULE_MODE may have changed
+                    schedule.clear()
+                    schedule_sweeps(address_monitor)
+                if changed:
+                    cloudflare_sweep(changed)
     except KeyboardInterrupt:
         schedule.clear()
+        shutdown_executors()
         log.warning("Cloudflare DDNS script interrupted")
         sys.exit(1)